@@ -1,4 +1,178 @@
 import csv
+import glob
+import os
+from argparse import ArgumentParser
+import numpy as np
+import pandas as pd
+from sinks import STATUS_LABELS, Status
+
+STATUSES = [s.name for s in Status]
+LABEL_STATUSES = {label: status.name for label,status in STATUS_LABELS.items()}
+CHUNKSIZE = 1000000 # Rows held in memory at once
+MAX_CENTS = 100000 # Prices up to $1000 are binned to the cent for the distribution, higher ones share the last bin
+
+#Output column names, looked up by header so every collector's layout can be read
+ID_COLUMNS = ('barcodeData','Product Id')
+PRICE_COLUMNS = ('price','Price')
+STORE_COLUMNS = ('storeId','locationId') # Long format sweep outputs (one row per product and store)
+
+def output_columns(path,columns):
+    """ Picks the product id, price and store columns out of an output's header
+
+    Args:
+        path (str): Output the header belongs to (for the error message)
+        columns (list): Column names of the output
+
+    Raises:
+        ValueError: The output has no product id or price column (e.g. a gluten free or nutrition run)
+
+    Returns:
+        (str, str, str): Product id, price and store column names (store is None unless it's a sweep output)
+    """
+    id_column = next((c for c in ID_COLUMNS if c in columns),None)
+    price_column = next((c for c in PRICE_COLUMNS if c in columns),None)
+    store_column = next((c for c in STORE_COLUMNS if c in columns),None)
+    if id_column is None or price_column is None:
+        raise ValueError(f'{path} is not a price output (columns: {", ".join(columns)})')
+    return id_column, price_column, store_column
+
+def product_ids(frame,id_column,store_column):
+    """ Product ids of a chunk. Sweep outputs key every row by store and product (e.g. 2250:10000001) """
+    ids = frame[id_column].astype(str)
+    if store_column is None:
+        return ids
+    return frame[store_column].astype(str) + ':' + ids
+
+def iter_output(path,chunksize=CHUNKSIZE):
+    """ Reads a collector output (csv file or parquet directory) in chunks and normalizes
+        each chunk into product_id, price and status columns. Columns are found by
+        their header names, so wide (collect_all), incremental (collect_changes) and
+        long format sweep outputs are read as well as the plain price outputs
+
+    Args:
+        path (str): Path to the output csv file or parquet directory
+        chunksize (int, optional): Max rows per chunk. Defaults to CHUNKSIZE.
+
+    Raises:
+        ValueError: The output has no product id or price column
+
+    Yields:
+        pandas.DataFrame: product_id (str), price (float64, NaN unless status is OK), status (category)
+    """
+    if os.path.isdir(path):
+        import pyarrow.parquet as pq
+        for part in sorted(glob.glob(os.path.join(path,'part-*.parquet'))):
+            parquet = pq.ParquetFile(part)
+            id_column, price_column, store_column = output_columns(path,parquet.schema_arrow.names)
+            columns = [c for c in (store_column,id_column,price_column,'status') if c is not None]
+            for batch in parquet.iter_batches(batch_size=chunksize,columns=columns):
+                frame = batch.to_pandas()
+                yield pd.DataFrame({
+                    'product_id': product_ids(frame,id_column,store_column),
+                    'price': frame[price_column].astype('float64'),
+                    'status': pd.Categorical(frame['status'].astype(str),categories=STATUSES),
+                })
+        return
+
+    id_column, price_column, store_column = output_columns(path,list(pd.read_csv(path,nrows=0).columns))
+    columns = [c for c in (store_column,id_column,price_column) if c is not None]
+    reader = pd.read_csv(path,usecols=columns,dtype=str,keep_default_na=False,chunksize=chunksize)
+    for frame in reader:
+        frame = pd.DataFrame({'product_id': product_ids(frame,id_column,store_column),'value': frame[price_column]})
+        price = pd.to_numeric(frame['value'],errors='coerce')
+        status = frame['value'].map(LABEL_STATUSES)
+        status = status.where(status.notna(),np.where(price.notna(),'OK','UNKNOWN'))
+        yield pd.DataFrame({
+            'product_id': frame['product_id'],
+            'price': price.where(status == 'OK'),
+            'status': pd.Categorical(status,categories=STATUSES),
+        })
+
+def iter_outputs(paths,chunksize=CHUNKSIZE):
+    """ Chains iter_output over several runs, adding a run column with each chunk's source path """
+    for path in paths:
+        for frame in iter_output(path,chunksize):
+            frame['run'] = path
+            yield frame
+
+def status_counts(paths,chunksize=CHUNKSIZE):
+    """ Counts how many rows of each run ended in each status
+
+    Args:
+        paths (list): Output files/directories of one or more runs
+
+    Returns:
+        pandas.DataFrame: One row per run, one column per status
+    """
+    counts = pd.DataFrame(0,index=pd.Index(paths,name='run'),columns=STATUSES)
+    for path in paths:
+        for frame in iter_output(path,chunksize):
+            counts.loc[path] += frame['status'].value_counts().reindex(STATUSES,fill_value=0)
+    return counts
+
+def price_distribution(paths,chunksize=CHUNKSIZE,quantiles=(0.05,0.25,0.5,0.75,0.95)):
+    """ Summarizes the found prices of one or more runs in fixed memory by
+        binning prices to the cent instead of holding them all
+
+    Args:
+        paths (list): Output files/directories of one or more runs
+        quantiles (tuple, optional): Quantiles to report
+
+    Returns:
+        pandas.Series: count, mean, min, max and the requested quantiles
+    """
+    bins = np.zeros(MAX_CENTS + 1,dtype=np.int64)
+    count, total, low, high = 0, 0.0, np.inf, -np.inf
+    for frame in iter_outputs(paths,chunksize):
+        prices = frame['price'].dropna().to_numpy()
+        if len(prices) == 0:
+            continue
+        count += len(prices)
+        total += prices.sum()
+        low, high = min(low,prices.min()), max(high,prices.max())
+        cents = np.clip(np.rint(prices * 100),0,MAX_CENTS).astype(np.int64)
+        bins += np.bincount(cents,minlength=MAX_CENTS + 1)
+
+    summary = {'count': count,'mean': total / count if count else np.nan,
+               'min': low if count else np.nan,'max': high if count else np.nan}
+    cumulative = np.cumsum(bins)
+    for q in quantiles:
+        summary[f'p{round(q * 100)}'] = np.searchsorted(cumulative,q * count) / 100 if count else np.nan
+    return pd.Series(summary)
+
+def load_prices(path,chunksize=CHUNKSIZE,partition=0,partitions=1):
+    """ Loads the product_id -> price of one run, keeping only one hash partition of the ids """
+    frames = []
+    for frame in iter_output(path,chunksize):
+        if partitions > 1:
+            keep = pd.util.hash_pandas_object(frame['product_id'],index=False).to_numpy() % partitions == partition
+            frame = frame[keep]
+        frames.append(frame[['product_id','price','status']])
+    prices = pd.concat(frames,ignore_index=True) if frames else pd.DataFrame(columns=['product_id','price','status'])
+    return prices.drop_duplicates('product_id',keep='last').set_index('product_id')
+
+def price_deltas(old_path,new_path,chunksize=CHUNKSIZE,partitions=1):
+    """ Compares the prices of two runs product by product
+
+        With partitions > 1 the product ids are split into that many hash partitions
+        and only one partition of each run is held in memory at a time
+
+    Args:
+        old_path (str): Output of the earlier run
+        new_path (str): Output of the later run
+        partitions (int, optional): Number of passes over the outputs. Defaults to 1.
+
+    Yields:
+        pandas.DataFrame: Indexed by product_id with old/new price and status, delta and pct_change,
+                          for products present in both runs
+    """
+    for partition in range(partitions):
+        old = load_prices(old_path,chunksize,partition,partitions)
+        new = load_prices(new_path,chunksize,partition,partitions)
+        merged = old.join(new,how='inner',lsuffix='_old',rsuffix='_new')
+        merged['delta'] = merged['price_new'] - merged['price_old']
+        merged['pct_change'] = merged['delta'] / merged['price_old']
+        yield merged
 
 def get_walmart_stats(input_file):
     """ Takes a csv file with product_id and price and prints how
@@ -7,35 +181,24 @@ def get_walmart_stats(input_file):
     Args:
         input_file (str): path to the csv file to be read/analyzed
     """
-    with open(input_file,'r') as csv_file:
-        csv_reader = csv.reader(csv_file)
-        next(csv_reader) #Skips over header    
-        not_found = 0
-        out_of_stock = 0
-        total = 0
-        for line in csv_reader:
-            total += 1
-            if line[1] == 'Product Not Found': not_found += 1
-            elif line[1] == 'Out of Stock': out_of_stock += 1
-        print(f'Out of Stock: {out_of_stock} of {total}')
-        print(f'Product Not Found: {not_found} of {total}')
-
-def parse_output(self,input_file,output_file):
+    counts = status_counts([input_file]).loc[input_file]
+    total = counts.sum()
+    print(f'Out of Stock: {counts["OUT_OF_STOCK"]} of {total}')
+    print(f'Product Not Found: {counts["NOT_FOUND"]} of {total}')
+
+def parse_output(input_file,output_file):
     """ Takes a csv file with product_id and price and writes to a new file the product ids
         of those that were Out of Stock and had no price returned in the API call
 
     Args:
         input_file (str): path to the input csv file
-        output_file (str): path to the output csv file 
+        output_file (str): path to the output csv file
     """
-    
-    with open(input_file,'r') as reader, open(output_file,'w') as writer:
-        csv_reader, csv_writer = csv.reader(reader), csv.writer(writer)
-        next(csv_reader)
+    with open(output_file,'w') as writer:
+        csv_writer = csv.writer(writer)
         csv_writer.writerow(['Product Id'])
-        for line in csv_reader:
-            if line[1] == 'Out of Stock':
-                csv_writer.writerow([line[0]])
+        for frame in iter_output(input_file):
+            csv_writer.writerows([item] for item in frame.loc[frame['status'] == 'OUT_OF_STOCK','product_id'])
 
 def get_kroger_stats(prices_file):
     """ Takes a csv file with kroger product ids and prices and prints how
@@ -43,17 +206,25 @@ def get_kroger_stats(prices_file):
 
     Args:
         prices_file (str): path to the csv file to be read/analyzed
-    """    
-    with open(prices_file,'r') as f1:
-        csv_reader = csv.reader(f1)
-        next(csv_reader)
-        count = 0
-        total = 0
-        for line in csv_reader:
-            if line[1] == 'DNE': count +=1 
-            total += 1
-        print(f'{count} out of {total} DNE')
+    """
+    counts = status_counts([prices_file]).loc[prices_file]
+    print(f'{counts["DNE"]} out of {counts.sum()} DNE')
 
 if __name__ == '__main__':
-    input_file = input('Enter path to csv file to be analyzed: ')
-    get_kroger_stats(input_file)
+    parser = ArgumentParser()
+    parser.add_argument('paths',nargs='*',help='collector outputs (csv files or parquet directories), oldest run first')
+    parser.add_argument('--partitions',type=int,help='passes the price comparison is split into '
+                                                     f'(defaults to one per {CHUNKSIZE} rows of the larger run)')
+    args = parser.parse_args()
+
+    paths = args.paths or [input('Enter path to csv file to be analyzed: ')]
+    counts = status_counts(paths)
+    print(counts.T)
+    print(price_distribution(paths))
+    if len(paths) > 1:
+        #Keeps about CHUNKSIZE rows of each run in memory at once
+        partitions = args.partitions or max(1,-(-int(counts.loc[paths[-2:]].sum(axis=1).max()) // CHUNKSIZE))
+        changed = [frame[frame['delta'].fillna(0) != 0] for frame in price_deltas(paths[-2],paths[-1],partitions=partitions)]
+        changed = pd.concat(changed)
+        print(f'{len(changed)} prices changed between the last two runs')
+        print(changed.sort_values('pct_change').head(20))
@@ -0,0 +1,54 @@
+""" Compares the compiled single-pass gluten matcher with the previous loop
+    of one uncompiled re.search per ingredient
+
+    Usage: python benchmarks/gluten_matcher.py [num_strings]
+"""
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from walmart import GLUTEN_INGREDIENTS, WalmartGlutenFree
+
+FILLER = ['sugar','corn syrup','water','salt','citric acid','fumaric acid','maltodextrin','natural flavors',
+          'soy lecithin','palm oil','rice flour','pectin','sodium citrate','vitamin c','yellow 5','cornstarch']
+
+def legacy_check(prod_ingredients):
+    for ingredient in GLUTEN_INGREDIENTS:
+        if re.search(ingredient,prod_ingredients,re.IGNORECASE) != None:
+            return False
+    return True
+
+def make_ingredients(num_strings,seed=0):
+    rng = random.Random(seed)
+    strings = []
+    for _ in range(num_strings):
+        words = rng.sample(FILLER,8)
+        if rng.random() < 0.2:
+            words.insert(rng.randrange(len(words)),rng.choice(GLUTEN_INGREDIENTS).upper())
+        strings.append(', '.join(words))
+    return strings
+
+def timed(func,strings):
+    start = time.perf_counter()
+    results = [func(s) for s in strings]
+    return results, time.perf_counter() - start
+
+if __name__ == '__main__':
+    num_strings = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    strings = make_ingredients(num_strings)
+    gf = WalmartGlutenFree('','')
+
+    legacy, legacy_time = timed(legacy_check,strings)
+    compiled, compiled_time = timed(gf.check_ingredients,strings)
+    start = time.perf_counter()
+    batch = gf.check_ingredients_batch(strings)
+    batch_time = time.perf_counter() - start
+
+    print(f'legacy loop      {legacy_time * 1e6 / num_strings:7.2f} us/string')
+    print(f'compiled         {compiled_time * 1e6 / num_strings:7.2f} us/string')
+    print(f'compiled batch   {batch_time * 1e6 / num_strings:7.2f} us/string')
+    print(f'verdicts that changed (substring false positives): {sum(a != b for a,b in zip(legacy,compiled))}')
@@ -0,0 +1,78 @@
+""" Compares decoding API responses with r.json() (the standard library) against the
+    fast paths in decoding.py: a full orjson decode, pruning an orjson decode to the
+    fields the extractors read, and a msgspec typed schema that skips the rest
+
+    Reports CPU time, peak bytes allocated while decoding and bytes the result keeps
+    alive, per response, for Walmart itemFields=store/detailed/all bodies and Kroger products.
+    Only the msgspec schema saves CPU and memory at once. Pruning an orjson decode (the
+    path used without msgspec) saves memory, but costs CPU on top of the full decode.
+
+    Usage: python benchmarks/json_decoding.py [num_responses]
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import decoding
+from decoding import Schema
+from kroger import PRICE_SCHEMA as KROGER_SCHEMA
+from walmart import RESPONSE_SCHEMAS
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'Example Responses')
+
+def bodies():
+    """ Walmart and Kroger response bodies shaped like the real ones (see benchmarks/stub_server.py) """
+    with open(os.path.join(EXAMPLES,'walmart.json')) as f:
+        walmart = json.load(f)
+    with open(os.path.join(EXAMPLES,'kroger.json')) as f:
+        kroger = json.load(f)
+    ids = {key: walmart[key] for key in ('sku','USItemId','offerId','upc','upcs','rank')}
+    responses = {field: {**ids,field: walmart[field]} for field in ('store','detailed')}
+    responses['all'] = walmart
+    encoded = {f'walmart {field}': (json.dumps(body).encode('utf-8'),RESPONSE_SCHEMAS[field].fields)
+               for field,body in responses.items()}
+    encoded['kroger product'] = (json.dumps(kroger).encode('utf-8'),KROGER_SCHEMA.fields)
+    return encoded
+
+def decoders(fields):
+    """ Name -> function decoding a body, skipping the ones whose library isn't installed """
+    funcs = {'r.json() (stdlib)': lambda body: json.loads(body.decode('utf-8'))}
+    if decoding.orjson is not None:
+        funcs['orjson full'] = decoding.orjson.loads
+        prune = Schema(fields).prune
+        funcs['orjson + prune'] = lambda body: prune(decoding.orjson.loads(body))
+    if decoding.msgspec is not None:
+        funcs['msgspec schema'] = Schema(fields).decode
+    return funcs
+
+def measure(func,body,num_responses):
+    """ Returns us of CPU, peak bytes allocated while decoding and bytes the result keeps alive, per response """
+    start = time.process_time()
+    for _ in range(num_responses):
+        func(body)
+    cpu = (time.process_time() - start) * 1e6 / num_responses
+
+    tracemalloc.start()
+    peaks = []
+    for _ in range(100):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func(body)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    before = tracemalloc.get_traced_memory()[0]
+    results = [func(body) for _ in range(100)]
+    retained = (tracemalloc.get_traced_memory()[0] - before) / len(results)
+    tracemalloc.stop()
+    return cpu, sum(peaks) / len(peaks), retained
+
+if __name__ == '__main__':
+    num_responses = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    for name,(body,fields) in bodies().items():
+        print(f'{name} ({len(body)} byte body)')
+        for decoder,func in decoders(fields).items():
+            cpu, allocated, retained = measure(func,body,num_responses)
+            print(f'  {decoder:<18} {cpu:8.1f} us/response {allocated / 1024:8.1f} KiB peak {retained / 1024:8.1f} KiB retained')
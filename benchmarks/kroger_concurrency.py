@@ -0,0 +1,46 @@
+""" Compares sequential, threaded and batched Kroger price collection against the
+    local stub server
+
+    Usage: python benchmarks/kroger_concurrency.py [num_ids] [latency_seconds]
+"""
+import csv
+import os
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kroger import KrogerPriceCollector
+from stub_server import StubServer
+
+def write_ids(path,num_ids):
+    with open(path,'w') as f:
+        csv_writer = csv.writer(f)
+        csv_writer.writerow(['barcodeData'])
+        for i in range(num_ids):
+            csv_writer.writerow([f'{i:013d}'])
+
+def run(server,input_file,output_file,workers,batch_size):
+    kroger = KrogerPriceCollector(input_file,output_file,workers)
+    kroger.api_base = server.url
+    kroger.batch_size = batch_size
+    with open(os.devnull,'w') as devnull, redirect_stdout(devnull):
+        kroger.get_access_token()
+        start = time.perf_counter()
+        kroger.collect_prices()
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    num_ids = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+
+    with tempfile.TemporaryDirectory() as tmp, StubServer(latency=latency) as server:
+        input_file = os.path.join(tmp,'input.csv')
+        write_ids(input_file,num_ids)
+        for batch_size in (1,50):
+            for workers in (1,4,16,32):
+                output_file = os.path.join(tmp,f'output_{workers}.csv')
+                elapsed = run(server,input_file,output_file,workers,batch_size)
+                print(f'batch_size={batch_size:<3} workers={workers:<3} {num_ids / elapsed:8.1f} ids/sec ({elapsed:.2f}s)')
@@ -0,0 +1,44 @@
+""" Measures per-request latency of Kroger product lookups over TLS with a
+    fresh connection per call (the plain requests module) versus a pooled
+    keep-alive session from sessions.make_session
+
+    Usage: python benchmarks/session_pooling.py [num_requests]
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from kroger import KrogerCore
+from sessions import make_session
+from stub_server import StubServer, make_self_signed_cert
+
+def measure(server,session,num_requests):
+    kroger = KrogerCore('','',session=session)
+    kroger.api_base = server.url
+    with open(os.devnull,'w') as devnull, redirect_stdout(devnull):
+        kroger.get_access_token()
+    latencies = []
+    for i in range(num_requests):
+        start = time.perf_counter()
+        kroger.get_product(f'{i:013d}')
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+if __name__ == '__main__':
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+
+    with tempfile.TemporaryDirectory() as tmp:
+        certfile, keyfile = make_self_signed_cert(tmp)
+        os.environ['REQUESTS_CA_BUNDLE'] = certfile # Trusted by both requests.get and sessions
+        with StubServer(certfile=certfile,keyfile=keyfile) as server:
+            for name,session in (('new connection per call',requests),('pooled session',make_session())):
+                latencies = sorted(measure(server,session,num_requests))
+                p50 = statistics.median(latencies) * 1000
+                p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+                print(f'{name:<24} p50 {p50:6.2f} ms  p99 {p99:6.2f} ms')
@@ -0,0 +1,235 @@
+""" Local stand-in for the Kroger and Walmart product APIs so the collectors can be
+    exercised without credentials or network access
+
+    Responses are built from the payloads in `Example Responses`, so they are as
+    large as the real ones. Latency, 5xx errors, connection resets and tokens
+    expiring early (401s) can all be injected.
+
+    Usage:
+        with StubServer(latency=0.05,error_rate=0.01,token_ttl=60) as server:
+            kroger = KrogerPriceCollector('in.csv','out.csv',workers=16)
+            kroger.api_base = server.url
+            kroger.get_access_token()
+            kroger.collect_prices()
+
+            walmart = WalmartPrices('in.csv','out.csv')
+            walmart.api_base = server.url
+"""
+import copy
+import json
+import os
+import random
+import socket
+import ssl
+import struct
+import subprocess
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlsplit
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'Example Responses')
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True # Headers and body go out in separate writes on kept-alive connections
+
+    def log_message(self,format,*args):
+        pass
+
+    def send_json(self,status,body,headers=None):
+        payload = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(payload)))
+        for key,value in (headers or {}).items():
+            self.send_header(key,value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def reset(self):
+        """ Drops the connection with a TCP RST instead of answering """
+        self.connection.setsockopt(socket.SOL_SOCKET,socket.SO_LINGER,struct.pack('ii',1,0))
+        self.close_connection = True
+        self.connection.close()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length',0))
+        self.rfile.read(length)
+        if urlsplit(self.path).path != '/v1/connect/oauth2/token':
+            return self.send_json(404,None)
+        token = self.server.stub.issue_token()
+        self.send_json(200,{'access_token': token,'expires_in': 1800,'token_type': 'bearer'})
+
+    def do_GET(self):
+        stub = self.server.stub
+        url = urlsplit(self.path)
+        stub.wait()
+
+        if url.path == '/v1/products':
+            stub.count('search')
+        elif url.path.startswith('/v1/products/'):
+            stub.count('products')
+        elif url.path.startswith('/v3/api/products/'):
+            stub.count('walmart')
+        else:
+            return self.send_json(404,None)
+
+        fault = stub.fault()
+        if fault == 'reset':
+            return self.reset()
+        if fault == 'error':
+            return self.send_json(503,{'error': 'unavailable'},{'Retry-After': '0'})
+
+        if url.path.startswith('/v3/api/products/'):
+            item_id = url.path.rsplit('/',1)[1]
+            if item_id.startswith('9'):
+                return self.send_json(404,None)
+            fields = parse_qs(url.query).get('itemFields',['store'])[0]
+            return self.send_json(200,stub.walmart_product(item_id,fields))
+
+        if not stub.authorized(self.headers.get('Authorization')):
+            return self.send_json(401,{'error': 'invalid_token'})
+
+        if url.path == '/v1/products':
+            item_ids = parse_qs(url.query).get('filter.productId',[''])[0].split(',')
+            #Missing products are left out of search results
+            return self.send_json(200,{'data': [stub.product(item_id) for item_id in item_ids if not item_id.startswith('9')]})
+
+        item_id = url.path.rsplit('/',1)[1]
+        if item_id.startswith('9'):
+            return self.send_json(404,None) #Empty body like a missing Kroger product
+        self.send_json(200,{'data': stub.product(item_id)})
+
+class StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+def make_self_signed_cert(directory):
+    """ Creates a throwaway certificate for 127.0.0.1 with the openssl cli
+
+    Returns:
+        (str, str): Paths to the certificate and its private key
+    """
+    certfile, keyfile = os.path.join(directory,'stub.crt'), os.path.join(directory,'stub.key')
+    subprocess.run(['openssl','req','-x509','-newkey','rsa:2048','-nodes','-days','1',
+                    '-subj','/CN=127.0.0.1','-addext','subjectAltName=IP:127.0.0.1',
+                    '-keyout',keyfile,'-out',certfile],check=True,capture_output=True)
+    return certfile, keyfile
+
+class StubServer:
+    """ Serves the token, Kroger product/search and Walmart product endpoints on a background thread
+
+    Args:
+        latency (float, optional): Seconds every product call takes. Defaults to 0.
+        jitter (float, optional): Up to this many extra seconds, picked at random per call. Defaults to 0.
+        error_rate (float, optional): Share of product calls answered with a 503. Defaults to 0.
+        reset_rate (float, optional): Share of product calls whose connection is reset. Defaults to 0.
+        token_ttl (float, optional): Seconds after which a token gets 401s, even though it
+                                     was issued with expires_in=1800. Defaults to never.
+        seed (int, optional): Seed for the injected faults. Defaults to 0.
+    """
+    def __init__(self,latency=0.0,host='127.0.0.1',port=0,certfile=None,keyfile=None,
+                 jitter=0.0,error_rate=0.0,reset_rate=0.0,token_ttl=None,seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.reset_rate = reset_rate
+        self.token_ttl = token_ttl
+        self.random = random.Random(seed)
+        self.token = ''
+        self.token_issued = 0.0
+        self.counts = {}
+        self.lock = Lock()
+        with open(os.path.join(EXAMPLES,'kroger.json')) as f:
+            self.kroger_template = json.load(f)['data']
+        with open(os.path.join(EXAMPLES,'walmart.json')) as f:
+            self.walmart_template = json.load(f)
+        self.httpd = StubHTTPServer((host,port),StubHandler)
+        self.httpd.stub = self
+        self.scheme = 'http'
+        if certfile is not None:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile,keyfile)
+            self.httpd.socket = context.wrap_socket(self.httpd.socket,server_side=True)
+            self.scheme = 'https'
+        self.thread = Thread(target=self.httpd.serve_forever,daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'{self.scheme}://{host}:{port}'
+
+    def issue_token(self):
+        with self.lock:
+            self.counts['token'] = self.counts.get('token',0) + 1
+            self.token = f'token-{self.counts["token"]}'
+            self.token_issued = time.monotonic()
+            return self.token
+
+    def expire_token(self):
+        """ Invalidates the current token so the next product call gets a 401 """
+        with self.lock:
+            self.token = 'expired'
+
+    def authorized(self,header):
+        with self.lock:
+            if self.token_ttl is not None and time.monotonic() - self.token_issued > self.token_ttl:
+                self.token = 'expired'
+            return header == f'Bearer {self.token}'
+
+    def count(self,key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key,0) + 1
+
+    def wait(self):
+        if self.latency or self.jitter:
+            with self.lock:
+                extra = self.random.uniform(0,self.jitter)
+            time.sleep(self.latency + extra)
+
+    def fault(self):
+        """ Picks the fault injected into a product call: 'reset', 'error' or None """
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.reset_rate:
+            self.count('resets')
+            return 'reset'
+        if roll < self.reset_rate + self.error_rate:
+            self.count('errors')
+            return 'error'
+        return None
+
+    @staticmethod
+    def price(item_id):
+        return round(1 + int(item_id[-4:]) / 100,2)
+
+    def product(self,item_id):
+        product = copy.deepcopy(self.kroger_template)
+        product['productId'] = product['upc'] = product['items'][0]['itemId'] = item_id
+        product['items'][0]['price']['regular'] = self.price(item_id)
+        return product
+
+    def walmart_product(self,item_id,fields):
+        """ Walmart response with the requested itemFields. Ids ending in 7 are out of stock """
+        template = self.walmart_template
+        product = {key: template[key] for key in ('sku','USItemId','offerId','upc','upcs','rank')}
+        product['USItemId'] = item_id
+        for field in ('basic','detailed','nutritionFacts','store'):
+            if fields in (field,'all'):
+                product[field] = template[field]
+        if 'store' in product:
+            store = copy.deepcopy(template['store'])
+            if not item_id.endswith('7'):
+                store['price']['list'] = self.price(item_id)
+                store['isInStock'] = True
+            product['store'] = store
+        return product
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self,*exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,173 @@
+""" Runs every collector end to end against the local stub server at several catalog
+    sizes and reports rows/sec, p50/p99 request latency and peak memory, so performance
+    regressions show up before deploying. Each run gets its own process, so its peak
+    memory is measured on its own.
+
+    Usage: python benchmarks/suite.py [--sizes 1000,10000] [--latency 0.005] [--error-rate 0.01]
+                                      [--reset-rate 0.005] [--token-ttl 5] [--collectors kroger,mixed]
+                                      [--json results.json]
+"""
+import csv
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kroger import KrogerPriceCollector
+from walmart import WalmartPrices, WalmartGlutenFree, WalmartNutritionFacts, WalmartCombined
+from mixed import MixedPriceCollector
+from scheduler import RequestScheduler
+from sessions import make_session
+from metrics import METRICS
+from stub_server import StubServer
+
+def kroger_id(i):
+    return f'9{i:012d}' if i % 50 == 0 else f'{i:013d}' # Every 50th id is missing
+
+def walmart_id(i):
+    return f'{90000000 + i}' if i % 50 == 0 else f'{10000000 + i}'
+
+def write_inputs(directory,size):
+    """ Writes the kroger, walmart and mixed input files for a catalog of size ids """
+    files = {
+        'kroger': (kroger_id,),
+        'walmart': (walmart_id,walmart_id), # WalmartPrices reads the second column, the other modes the first
+        'mixed': (lambda i: kroger_id(i) if i % 2 else walmart_id(i),),
+    }
+    for name,columns in files.items():
+        with open(os.path.join(directory,f'{name}-{size}.csv'),'w') as f:
+            csv_writer = csv.writer(f)
+            csv_writer.writerow(['id'] * len(columns))
+            for i in range(size):
+                csv_writer.writerow([column(i) for column in columns])
+
+def make_scheduler(args):
+    #Recovers the full rate within a second of clean traffic, so injected errors exercise the
+    #retry path without throttling the rest of the run
+    return RequestScheduler(rate=args.rate,max_rate=args.rate,increase=args.rate,backoff=0.01,max_backoff=0.1)
+
+def kroger(args,input_file,output_file):
+    collector = KrogerPriceCollector(input_file,output_file,args.workers,scheduler=make_scheduler(args))
+    collector.api_base = args.url
+    collector.authenticate()
+    return collector.collect_prices
+
+def kroger_sweep(args,input_file,output_file):
+    collector = KrogerPriceCollector(input_file,output_file,args.workers,scheduler=make_scheduler(args))
+    collector.api_base = args.url
+    collector.authenticate()
+    return lambda: collector.sweep_prices(['01400929','01400930','01400931'])
+
+def walmart(collector_class,method):
+    def setup(args,input_file,output_file):
+        collector = collector_class(input_file,output_file,scheduler=make_scheduler(args),
+                                    session=make_session(pool_size=max(10,args.workers)))
+        collector.api_base = args.url
+        collector.workers = args.workers
+        return getattr(collector,method)
+    return setup
+
+def walmart_sweep(args,input_file,output_file):
+    collector = WalmartPrices(input_file,output_file,scheduler=make_scheduler(args),
+                              session=make_session(pool_size=max(10,args.workers)))
+    collector.api_base = args.url
+    collector.workers = args.workers
+    return lambda: collector.sweep_prices([2250,2251,2252])
+
+def mixed(args,input_file,output_file):
+    collector = MixedPriceCollector(input_file,output_file,args.workers,args.workers)
+    collector.krg.api_base = collector.wmt.api_base = args.url
+    collector.krg.scheduler, collector.wmt.scheduler = make_scheduler(args), make_scheduler(args)
+    collector.authenticate()
+    return collector.collect_prices
+
+#Name -> (input file, setup returning the function to time)
+COLLECTORS = {
+    'kroger': ('kroger',kroger),
+    'kroger-sweep': ('kroger',kroger_sweep),
+    'walmart-prices': ('walmart',walmart(WalmartPrices,'collect_prices')),
+    'walmart-gf': ('walmart',walmart(WalmartGlutenFree,'label_GF_products')),
+    'walmart-nf': ('walmart',walmart(WalmartNutritionFacts,'collect_nutrition')),
+    'walmart-all': ('walmart',walmart(WalmartCombined,'collect_all')),
+    'walmart-sweep': ('walmart',walmart_sweep),
+    'mixed': ('mixed',mixed),
+}
+
+def run_child(args):
+    """ Runs one collector in this process and prints its results as json """
+    input_name, setup = COLLECTORS[args.child]
+    input_file = os.path.join(args.dir,f'{input_name}-{args.size}.csv')
+    output_file = os.path.join(args.dir,f'output-{args.child}-{args.size}.csv')
+    METRICS.interval = float('inf') # No progress summaries
+    with open(os.devnull,'w') as devnull, redirect_stdout(devnull):
+        collect = setup(args,input_file,output_file)
+        start = time.perf_counter()
+        collect()
+        elapsed = time.perf_counter() - start
+    latency = METRICS.merged('collector_request_seconds')
+    print(json.dumps({
+        'collector': args.child,
+        'size': args.size,
+        'rows': METRICS.total('collector_rows_total'),
+        'seconds': elapsed,
+        'rows_per_second': METRICS.total('collector_rows_total') / elapsed,
+        'requests': METRICS.total('collector_requests_total'),
+        'retries': METRICS.total('collector_retries_total'),
+        'p50_ms': latency.quantile(0.5) * 1000 if latency.count else None,
+        'p99_ms': latency.quantile(0.99) * 1000 if latency.count else None,
+        'peak_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, # Linux reports KiB
+    }))
+
+def run_suite(args):
+    results = []
+    collectors = args.collectors.split(',') if args.collectors else list(COLLECTORS)
+    with tempfile.TemporaryDirectory() as tmp, StubServer(latency=args.latency,jitter=args.jitter,error_rate=args.error_rate,
+                                                          reset_rate=args.reset_rate,token_ttl=args.token_ttl) as server:
+        print(f'{"collector":<15} {"ids":>7} {"rows/s":>9} {"p50 ms":>7} {"p99 ms":>7} {"peak MB":>8} {"retries":>7}')
+        for size in map(int,args.sizes.split(',')):
+            write_inputs(tmp,size)
+            for name in collectors:
+                child = subprocess.run([sys.executable,os.path.abspath(__file__),'--child',name,'--size',str(size),
+                                        '--url',server.url,'--dir',tmp,'--workers',str(args.workers),'--rate',str(args.rate)],
+                                       capture_output=True,text=True,cwd=tmp)
+                if child.returncode != 0:
+                    print(f'{name:<15} {size:>7} failed\n{child.stderr}')
+                    continue
+                result = json.loads(child.stdout.splitlines()[-1])
+                results.append(result)
+                print(f'{name:<15} {size:>7} {result["rows_per_second"]:9.1f} {result["p50_ms"] or 0:7.1f} '
+                      f'{result["p99_ms"] or 0:7.1f} {result["peak_mb"]:8.1f} {result["retries"]:>7}')
+    if args.json:
+        with open(args.json,'w') as f:
+            json.dump(results,f,indent=2)
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--sizes',default='1000,10000',help='comma separated catalog sizes')
+    parser.add_argument('--collectors',help=f'comma separated subset of {",".join(COLLECTORS)}')
+    parser.add_argument('--workers',type=int,default=8,help='concurrent lookups per collector')
+    parser.add_argument('--rate',type=float,default=5000.0,help='requests per second allowed by each scheduler')
+    parser.add_argument('--latency',type=float,default=0.005,help='seconds every stub product call takes')
+    parser.add_argument('--jitter',type=float,default=0.0,help='up to this many extra seconds per call')
+    parser.add_argument('--error-rate',type=float,default=0.0,help='share of calls answered with a 503')
+    parser.add_argument('--reset-rate',type=float,default=0.0,help='share of calls whose connection is reset')
+    parser.add_argument('--token-ttl',type=float,help='seconds before kroger tokens start getting 401s')
+    parser.add_argument('--json',help='file the results are written to')
+    #Used by the suite to run a single collector in a child process
+    parser.add_argument('--child',help=None)
+    parser.add_argument('--size',type=int)
+    parser.add_argument('--url')
+    parser.add_argument('--dir')
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+    else:
+        run_suite(args)
@@ -0,0 +1,101 @@
+import json
+import sqlite3
+from threading import Lock
+from time import time
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+class ResponseCache:
+    """ Persistent SQLite cache of API responses keyed by (retailer, item_id, field, store)
+
+        Each field has its own time to live, so prices expire within hours while
+        descriptions and nutrition facts are reused for weeks. Once the cache
+        grows past max_entries the oldest responses are evicted. Safe to share
+        between threads.
+    """
+    ttls = {
+        'store': 12 * HOUR, # Walmart price & stock
+        'all': 12 * HOUR,
+        'product': 12 * HOUR, # Kroger product w/ location price
+        'basic': 30 * DAY,
+        'detailed': 30 * DAY,
+        'nutritionFacts': 30 * DAY,
+    }
+
+    def __init__(self,path='responses.db',ttls=None,default_ttl=DAY,max_entries=1000000):
+        self.path = path
+        self.ttls = {**self.ttls,**(ttls or {})}
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.lock = Lock()
+        self.db = sqlite3.connect(path,check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                            retailer TEXT, item_id TEXT, field TEXT, store TEXT,
+                            response TEXT, fetched_at REAL,
+                            PRIMARY KEY (retailer, item_id, field, store))""")
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_age ON responses (fetched_at)')
+        self.db.commit()
+
+    def ttl(self,field):
+        return self.ttls.get(field,self.default_ttl)
+
+    def get(self,retailer,item_id,field,store='',decode=json.loads):
+        """ Looks up a cached response that has not outlived its field's TTL
+
+        Args:
+            decode (callable, optional): Turns the stored JSON text into the response,
+                                         e.g. Schema.decode. Defaults to json.loads.
+
+        Returns:
+            dict or str: The cached response, or None on a miss
+        """
+        with self.lock:
+            row = self.db.execute('SELECT response FROM responses WHERE retailer=? AND item_id=? AND field=? AND store=? AND fetched_at>=?',
+                                  (retailer,str(item_id),field,str(store),time() - self.ttl(field))).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return decode(row[0])
+
+    def set(self,retailer,item_id,field,store,response):
+        """ Stores a response, evicting the oldest entries every so often once the cache is full.
+            bytes are taken as the response body already encoded as JSON and stored as is,
+            so the whole body is kept even when only a few fields of it were decoded
+        """
+        if isinstance(response,bytes):
+            value = response.decode('utf-8')
+        else:
+            value = json.dumps(response,separators=(',',':'))
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?,?)',
+                            (retailer,str(item_id),field,str(store),value,time()))
+            self.writes += 1
+            if self.writes % 1000 == 0:
+                self.evict()
+            self.db.commit()
+
+    def evict(self):
+        """ Deletes the oldest rows beyond max_entries (caller holds the lock) """
+        count = self.db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        if count > self.max_entries:
+            self.db.execute('DELETE FROM responses WHERE rowid IN (SELECT rowid FROM responses ORDER BY fetched_at LIMIT ?)',
+                            (count - self.max_entries,))
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def summary(self):
+        return f'Cache: {self.hits} hits, {self.misses} misses ({self.hit_rate():.1%} hit rate)'
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
@@ -0,0 +1,57 @@
+import json
+import os
+from itertools import islice
+
+class Checkpoint:
+    """ Records how far a collection run got in a small sidecar file
+        (<output file>.checkpoint) so a crashed run can be resumed
+
+        The checkpoint stores how many input rows were consumed and the output
+        sink's position after flushing them (bytes for csv, finished part files
+        for parquet). Resuming drops anything written after the last checkpoint,
+        skips the consumed input rows and appends to the existing output.
+    """
+    def __init__(self,output_file_name,resume=False):
+        self.output_file_name = output_file_name
+        self.path = f'{output_file_name}.checkpoint'
+        self.input_rows = 0
+        self.output_position = 0
+        self.resumed = resume and self.load()
+
+    def load(self):
+        """ Reads the checkpoint file if there is one for an existing output file
+
+        Returns:
+            boolean: True if the run can be resumed from the checkpoint
+        """
+        if not (os.path.exists(self.path) and os.path.exists(self.output_file_name)):
+            return False
+        with open(self.path,'r') as f:
+            state = json.load(f)
+        self.input_rows = state['input_rows']
+        self.output_position = state['output_position']
+        return True
+
+    def skip(self,rows):
+        """ Skips the input rows that were already consumed before the checkpoint """
+        return islice(rows,self.input_rows,None)
+
+    def save(self,sink):
+        """ Flushes the output sink and atomically records the current position
+
+        Args:
+            sink (CsvSink or ParquetSink): The run's output sink
+        """
+        self.output_position = sink.flush()
+        tmp = f'{self.path}.tmp'
+        with open(tmp,'w') as f:
+            json.dump({'input_rows': self.input_rows,'output_position': self.output_position},f)
+        os.replace(tmp,self.path)
+
+    def advance(self,sink):
+        """ Marks one more input row as done and saves the checkpoint every
+            sink.rows_per_flush rows
+        """
+        self.input_rows += 1
+        if self.input_rows % sink.rows_per_flush == 0:
+            self.save(sink)
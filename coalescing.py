@@ -0,0 +1,69 @@
+from concurrent.futures import Future
+from threading import Lock
+from metrics import METRICS
+
+class Coalescer:
+    """ Lets concurrent requests for the same key share one in-flight call
+
+        The first caller of a key makes the call. Anyone asking for the key while
+        it is still running waits for that call and gets the same response (or
+        exception) instead of sending a duplicate request. Finished keys are
+        forgotten, the cores' caches serve repeats after that. Safe to share
+        between threads and between cores, e.g. several collectors in one process.
+    """
+    def __init__(self,metrics=METRICS):
+        self.in_flight = {} # key -> Future of the running call
+        self.lock = Lock()
+        self.metrics = metrics
+
+    def claim(self,key):
+        """ Joins the call running for key, or registers the caller as the one making it
+
+        Returns:
+            (Future, bool): The key's future and whether the caller owns it. The owner
+                            must finish it with resolve, the others wait on future.result()
+        """
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                owner = False
+            else:
+                future = self.in_flight[key] = Future()
+                owner = True
+        if not owner:
+            self.metrics.count('collector_coalesced_total',retailer=key[0])
+        return future, owner
+
+    def resolve(self,key,future,result=None,error=None):
+        """ Hands the owner's result (or exception) to every waiter and forgets the key """
+        with self.lock:
+            if self.in_flight.get(key) is future:
+                del self.in_flight[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def call(self,key,func,*args,**kwargs):
+        """ Calls func unless a call for key is already running, in which case its result is shared
+
+        Args:
+            key (tuple): Identifies the request, starting with the retailer (e.g. ('walmart', item_id, field, store))
+            func (callable): Makes the request
+
+        Returns:
+            The return value of func (raises its exception)
+        """
+        future, owner = self.claim(key)
+        if not owner:
+            return future.result()
+        try:
+            result = func(*args,**kwargs)
+        except BaseException as e:
+            self.resolve(key,future,error=e)
+            raise
+        self.resolve(key,future,result)
+        return result
+
+#Process wide coalescer shared by the cores, so collectors running side by side never send the same request twice at once
+COALESCER = Coalescer()
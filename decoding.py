@@ -0,0 +1,115 @@
+import json
+from typing import Any, List, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+def loads(data):
+    """ Decodes a whole JSON document with the fastest decoder installed
+        (orjson when available, the standard library otherwise)
+
+    Args:
+        data (bytes or str): JSON text, e.g. a response's content
+
+    Returns:
+        The decoded value
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def normalize(fields):
+    """ Turns a fields declaration into nested dicts of key -> sub fields (None keeps the whole value).
+        A list or set of keys is shorthand for keeping each of those keys whole
+    """
+    if fields is None:
+        return None
+    if not isinstance(fields,dict):
+        return {key: None for key in fields}
+    return {key: normalize(sub) for key,sub in fields.items()}
+
+def projector(fields):
+    """ Compiles a fields declaration into a function keeping only the declared fields of an
+        already decoded value. Lists are pruned element by element and anything that isn't
+        a dict is kept as is, so missing keys still raise KeyError in the extractors like
+        they always did. Whole values are copied with one dict comprehension per level,
+        which is what keeps pruning cheap next to the decode itself
+
+    Returns:
+        callable: Takes a decoded value and returns the pruned value (None for no declaration)
+    """
+    if fields is None:
+        return None
+    leaves = tuple(key for key,sub in fields.items() if sub is None)
+    nested = tuple((key,projector(sub)) for key,sub in fields.items() if sub is not None)
+
+    def prune(value):
+        if type(value) is dict:
+            pruned = {key: value[key] for key in leaves if key in value}
+            for key,sub in nested:
+                if key in value:
+                    pruned[key] = sub(value[key])
+            return pruned
+        if type(value) is list:
+            return [prune(element) for element in value]
+        return value
+    return prune
+
+def struct_type(fields,name='Response'):
+    """ Builds the msgspec type decoding only the declared fields. Undeclared
+        fields are skipped by the decoder without being turned into Python objects
+    """
+    if fields is None:
+        return Any
+    struct = msgspec.defstruct(name,[(key,struct_type(sub,f'{name}_{key}'),msgspec.UNSET) for key,sub in fields.items()])
+    return Union[struct,List[struct],str,int,float,bool,None]
+
+class Schema:
+    """ The fields of an API response its extractors read (e.g. find_price only needs
+        store.price.list/displayPrice and store.isInStock), decoded without the rest
+
+        With msgspec installed the declared fields are decoded through a typed schema
+        and everything else is skipped while parsing, which costs less CPU than r.json().
+        Otherwise the response is decoded with orjson (or the standard library) and then
+        pruned to the declared fields. That only saves memory, the pruning pass takes
+        CPU on top of the decode (see benchmarks/json_decoding.py). Either way the
+        pipeline queues, the response LRU and the parse stage only hold small dicts, and
+        the result is plain dicts and lists, as if r.json() had been pruned.
+
+            PRICE = Schema({'store': {'price': ['list','displayPrice'],'isInStock': None}})
+            PRICE.decode(r.content) -> {'store': {'price': {'list': 2.5},'isInStock': True}}
+
+    Args:
+        fields (dict, optional): key -> sub fields (a dict, a list of keys, or None for the
+                                 whole value). None decodes the whole response.
+    """
+    def __init__(self,fields=None):
+        self.fields = normalize(fields)
+        self.prune = projector(self.fields)
+        self.decoder = None
+        if msgspec is not None and self.fields is not None:
+            self.decoder = msgspec.json.Decoder(struct_type(self.fields))
+
+    def decode(self,data):
+        """ Decodes a JSON body (bytes or str) into the declared fields """
+        if self.decoder is not None:
+            try:
+                return msgspec.to_builtins(self.decoder.decode(data))
+            except msgspec.DecodeError: #Shaped unlike the declaration (or not JSON, which loads reports)
+                pass
+        value = loads(data)
+        return value if self.prune is None else self.prune(value)
+
+    def select(self,value):
+        """ Prunes an already decoded response to the declared fields """
+        return value if self.prune is None else self.prune(value)
+
+#Decodes every field, for responses without a declaration
+FULL = Schema()
@@ -0,0 +1,124 @@
+import sqlite3
+from heapq import nlargest
+from threading import Lock
+from time import time
+from cache import HOUR, DAY
+
+#Prices meaning the retailer doesn't know the id, after enough of these in a row the id is skipped
+MISSING = {'DNE','Product Not Found'}
+#Transient failures, not recorded so the id is tried again on the next run
+ERRORS = {'Connection Error','HTTP Error Occured'}
+
+class PriceHistory:
+    """ Persistent SQLite store of the last known price of every product, used by
+        incremental runs to only re-fetch products whose price is likely to have changed
+
+        Each product's volatility is a moving average of how often its price changed
+        between checks. Volatile products are re-checked every min_interval and stable
+        ones drift out to max_interval. Ids that were missing (DNE/Product Not Found)
+        skip_after runs in a row are only re-checked every missing_interval.
+        Safe to share between threads.
+    """
+    def __init__(self,path='history.db',min_interval=12 * HOUR,max_interval=7 * DAY,skip_after=3,missing_interval=30 * DAY,smoothing=0.3):
+        self.path = path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.skip_after = skip_after
+        self.missing_interval = missing_interval
+        self.smoothing = smoothing # Weight of the latest check in the volatility average
+        self.checked = 0
+        self.changed = 0
+        self.skipped = 0
+        self.lock = Lock()
+        self.db = sqlite3.connect(path,check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute("""CREATE TABLE IF NOT EXISTS history (
+                            retailer TEXT, item_id TEXT, store TEXT, price TEXT,
+                            checked_at REAL, changed_at REAL, volatility REAL, misses INTEGER,
+                            PRIMARY KEY (retailer, item_id, store))""")
+        self.db.commit()
+
+    def interval(self,volatility,misses):
+        """ Seconds a product's last price is trusted for before it is due again """
+        if misses >= self.skip_after:
+            return self.missing_interval
+        return self.max_interval - volatility * (self.max_interval - self.min_interval)
+
+    def priority(self,retailer,item_id,store,now):
+        """ How overdue a product is, its staleness divided by its interval.
+            1 or more means it is due, products never checked before come first
+        """
+        with self.lock:
+            row = self.db.execute('SELECT checked_at, volatility, misses FROM history WHERE retailer=? AND item_id=? AND store=?',
+                                  (retailer,str(item_id),str(store))).fetchone()
+        if row is None:
+            return float('inf')
+        checked_at, volatility, misses = row
+        return (now - checked_at) / self.interval(volatility,misses)
+
+    def plan(self,retailer,item_ids,store='',budget=None):
+        """ Picks the products an incremental run should fetch
+
+        Args:
+            retailer (str): 'kroger' or 'walmart'
+            item_ids (iterable): Every product id of the catalog
+            store (str, optional): Store/location the prices are collected at
+            budget (int, optional): Max number of products to fetch. Defaults to every due product.
+
+        Returns:
+            iterable: The due ids, streamed in input order, or with a budget
+                      the `budget` most overdue ids, most overdue first
+        """
+        now = time()
+        def due():
+            for item_id in item_ids:
+                priority = self.priority(retailer,item_id,store,now)
+                if priority >= 1:
+                    yield priority, item_id
+                else:
+                    self.skipped += 1
+
+        if budget is None:
+            return (item_id for _,item_id in due())
+        return [item_id for _,item_id in nlargest(budget,due(),key=lambda pair: pair[0])]
+
+    def record(self,retailer,item_id,store,price):
+        """ Saves the price found by a check and updates the product's volatility
+
+        Args:
+            price (str or float): A price or one of the collectors' sentinel strings
+
+        Returns:
+            (bool, str): Whether the price is new or changed, and the previous price (None for new products)
+        """
+        price = str(price)
+        if price in ERRORS:
+            return False, None
+        now = time()
+        with self.lock:
+            row = self.db.execute('SELECT price, changed_at, volatility, misses FROM history WHERE retailer=? AND item_id=? AND store=?',
+                                  (retailer,str(item_id),str(store))).fetchone()
+            if row is None:
+                changed, previous, changed_at, volatility, misses = True, None, now, 0.5, 0
+            else:
+                previous, changed_at, volatility, misses = row
+                changed = price != previous
+                volatility += self.smoothing * (changed - volatility)
+                if changed:
+                    changed_at = now
+            misses = misses + 1 if price in MISSING else 0
+            self.db.execute('INSERT OR REPLACE INTO history VALUES (?,?,?,?,?,?,?,?)',
+                            (retailer,str(item_id),str(store),price,now,changed_at,volatility,misses))
+            self.db.commit()
+            self.checked += 1
+            self.changed += changed
+        return changed, previous
+
+    def summary(self):
+        return f'History: {self.checked} checked, {self.changed} new or changed, {self.skipped} skipped as not due'
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
@@ -2,16 +2,46 @@ import csv
 from base64 import b64encode
 from time import time
 from configparser import ConfigParser
-import requests 
+from argparse import ArgumentParser
+from workers import chunks, ordered_map
+from checkpoint import Checkpoint
+from sinks import open_sink
+from cache import ResponseCache
+from history import PriceHistory
+from pipeline import collect, fan_out, fetch_batches, find_repeats, parse, read_ids, unique
+from metrics import METRICS
+from sessions import CONNECTION_ERRORS, make_session
+from tokens import TokenManager
+from decoding import FULL, Schema, loads
+from coalescing import COALESCER
+
+#Fields find_price reads from a product response. Everything else is skipped when decoding, see decoding.py
+PRICE_FIELDS = {'data': {'items': {'price': ['regular']}}}
+PRICE_SCHEMA = Schema(PRICE_FIELDS)
+
+#Products API page size, the most ids one products search call can return
+MAX_BATCH_SIZE = 50
 
 class KrogerCore:
-    def __init__(self,input_file_name,output_file_name):
+    def __init__(self,input_file_name,output_file_name,workers=1,resume=False,cache=None,session=None,scheduler=None):
         self.input_file_name = input_file_name
         self.output_file_name = output_file_name
         self.credentials = ''
         self.api_base = 'https://api-ce.kroger.com'
-        self.access_token = ''
+        self.tokens = TokenManager(self.request_access_token) # Refreshes the access token before it expires
         self.location_id = '01400929' # 1 W Corry St, Cincinnati, OH 45219
+        self.workers = workers # Number of concurrent product lookups
+        self.resume = resume # Continue from the output file's checkpoint instead of starting over
+        self.cache = cache # Optional ResponseCache shared across runs
+        self.session = session or make_session(pool_size=max(10,workers)) # Pooled keep-alive connections, see sessions.py
+        self.timeout = 30 # Seconds before a request is abandoned
+        self.scheduler = scheduler # Optional RequestScheduler rate limiting product calls
+        self.batch_size = MAX_BATCH_SIZE # Product ids per products search call, at most MAX_BATCH_SIZE (1 looks every id up on its own)
+        self.history = None # Optional PriceHistory for incremental runs, see history.py
+        self.metrics = METRICS # Request, cache and progress metrics, see metrics.py
+        self.row_counts = None # Optional file recording how many rows each input row produced, see pipeline.collect
+        self.schema = FULL # Fields decoded from product responses, see decoding.py (FULL decodes every field)
+        self.coalescer = COALESCER # Shares in-flight requests for the same product, see coalescing.py
     
     @staticmethod
     def url_to_uuid(input_name,output_name):
@@ -62,62 +92,211 @@ class KrogerCore:
         
         print('Credentials Created')
     
-    def get_access_token(self):
-        """ Calls the Kroger authentication API using the credentials
-            property and sets the access token property as the api return value
+    @property
+    def access_token(self):
+        return self.tokens.token
+
+    def request_access_token(self):
+        """ Calls the Kroger authentication API using the credentials property
+
+        Returns:
+            (str, int): The access token and the number of seconds it is valid for
         """
         headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
             'Authorization': f'Basic {self.credentials}'
         }
         payload = 'grant_type=client_credentials&scope=product.compact'
-        r = requests.post(f'{self.api_base}/v1/connect/oauth2/token',headers=headers,data=payload) 
+        post = self.metrics.timed(self.session.post,retailer='kroger',endpoint='token')
+        r = post(f'{self.api_base}/v1/connect/oauth2/token',headers=headers,data=payload,timeout=self.timeout)
         r.raise_for_status()
-        self.access_token = r.json()['access_token']
+        body = r.json()
         print('Access Token Received')
+        return body['access_token'], body.get('expires_in',1800)
 
-    def get_product(self,item_id):
+    def get_access_token(self):
+        """ Gets a new access token from the Kroger authentication API right away,
+            even if the current one is still valid
+        """
+        with self.tokens.lock:
+            self.tokens.refresh()
+
+    def authenticate(self):
+        """ Loads the credentials and makes sure there is a valid access token,
+            reusing a saved one instead of calling the auth API when possible
+        """
+        self.get_credentials()
+        self.tokens.get()
+
+    def get_product(self,item_id,location_id=None):
         """ Calls the kroger API for the specified product
-            and returns the response as a dict 
+            and returns the response as a dict. Responses are
+            served from the cache when one is set and still fresh.
+            Only the fields in the schema property are decoded (every field unless
+            a subclass declares a Schema, like KrogerPriceCollector). A request for
+            a product/location that is already in flight shares that call's response
 
         Args:
             item_id (str): The 13 digit Kroger product id (leading 0s are only retained in string form)
+            location_id (str, optional): Store to price the product at. Defaults to the location_id property.
 
         Returns:
             dict: JSON response from API or empty dict signifying an empty response
         """
-        url = f'{self.api_base}/v1/products/{item_id}?filter.locationId={self.location_id}'
+        location_id = location_id or self.location_id
+        return self.coalescer.call(('kroger',item_id,location_id,self.schema),self.request_product,item_id,location_id)
 
+    def request_product(self,item_id,location_id):
+        """ Looks a product up in the cache, then the API (see get_product) """
+        if self.cache is not None:
+            response = self.cache.get('kroger',item_id,'product',location_id,self.schema.decode)
+            self.metrics.count('collector_cache_lookups_total',retailer='kroger',result='miss' if response is None else 'hit')
+            if response is not None:
+                return response
+
+        url = f'{self.api_base}/v1/products/{item_id}?filter.locationId={location_id}'
+
+        token = self.tokens.get()
         headers = {
             'Accept': 'application/json',
-            'Authorization': f'Bearer {self.access_token}'
+            'Authorization': f'Bearer {token}'
         }
-        r = requests.get(url,headers=headers)
+        send = self.metrics.timed(self.session.get,retailer='kroger',endpoint='product')
+        if self.scheduler is not None:
+            r = self.scheduler.request(send,url,headers=headers,timeout=self.timeout)
+        else:
+            r = send(url,headers=headers,timeout=self.timeout)
         
-        #Checks for invalid/expired access token
+        #Checks for a token revoked before its expiry
         if r.status_code == 401:
-            self.get_access_token()
-            return self.get_product(item_id)
+            self.tokens.invalidate(token)
+            return self.request_product(item_id,location_id)
         
-        if int(r.headers['content-length']) > 0:
-            return r.json()
+        body = r.content # The cache keeps the whole body
+        if body: #HTTP/2 and chunked responses don't have to carry a content-length
+            response = self.schema.decode(body)
         else:
-            return {}
+            response = body = {}
+
+        if self.cache is not None:
+            self.cache.set('kroger',item_id,'product',location_id,body)
+        return response
+
+    def search_products(self,item_ids,location_id):
+        """ Looks up several products in one call to the products search endpoint
+
+        Args:
+            item_ids (list): Kroger product ids
+            location_id (str): Store to price the products at
+
+        Returns:
+            dict: product id -> response shaped like get_product's, or None if the call failed
+        """
+        url = f'{self.api_base}/v1/products?filter.productId={",".join(item_ids)}&filter.locationId={location_id}&filter.limit={len(item_ids)}'
+
+        token = self.tokens.get()
+        headers = {
+            'Accept': 'application/json',
+            'Authorization': f'Bearer {token}'
+        }
+        send = self.metrics.timed(self.session.get,retailer='kroger',endpoint='search')
+        try:
+            if self.scheduler is not None:
+                r = self.scheduler.request(send,url,headers=headers,timeout=self.timeout)
+            else:
+                r = send(url,headers=headers,timeout=self.timeout)
+        except CONNECTION_ERRORS:
+            return None
+
+        if r.status_code == 401:
+            self.tokens.invalidate(token)
+            return self.search_products(item_ids,location_id)
+        if r.status_code != 200:
+            return None
+        try:
+            return {product['productId']: {'data': product} for product in loads(r.content)['data']}
+        except (ValueError,KeyError,TypeError):
+            return None
+
+    def get_products(self,item_ids,location_id=None):
+        """ Gets many products with one API call per batch instead of one per product.
+            Cached products are not requested again, products already in flight
+            are waited for, ids missing from the response get an empty dict
+            (like get_product) and if the batch call fails every product is
+            looked up on its own instead. Products whose own lookup keeps
+            resetting the connection get 'Connection Error'
+
+        Args:
+            item_ids (list): Kroger product ids (at most the API's page size, MAX_BATCH_SIZE)
+            location_id (str, optional): Store to price the products at. Defaults to the location_id property.
+
+        Returns:
+            dict: product id -> JSON response shaped like get_product's (or 'Connection Error')
+        """
+        location_id = location_id or self.location_id
+        if len(item_ids) == 1:
+            try:
+                return {item_ids[0]: self.get_product(item_ids[0],location_id)}
+            except CONNECTION_ERRORS:
+                return {item_ids[0]: 'Connection Error'}
+        responses = {}
+        if self.cache is not None:
+            for item_id in item_ids:
+                response = self.cache.get('kroger',item_id,'product',location_id,self.schema.decode)
+                self.metrics.count('collector_cache_lookups_total',retailer='kroger',result='miss' if response is None else 'hit')
+                if response is not None:
+                    responses[item_id] = response
+        missing = list(dict.fromkeys(item_id for item_id in item_ids if item_id not in responses))
+        if not missing:
+            return responses
+
+        #Products another call is already fetching are waited for instead of requested again
+        claims = {item_id: self.coalescer.claim(('kroger',item_id,location_id,self.schema)) for item_id in missing}
+        owned = [item_id for item_id in missing if claims[item_id][1]]
+        try:
+            found = self.search_products(owned,location_id) if len(owned) > 1 else None
+            for item_id in owned:
+                if found is None:
+                    try:
+                        response = self.request_product(item_id,location_id)
+                    except CONNECTION_ERRORS: #One reset doesn't end the run, like pipeline.fetch
+                        response = 'Connection Error'
+                else:
+                    response = found.get(item_id,{})
+                    if self.cache is not None:
+                        self.cache.set('kroger',item_id,'product',location_id,response)
+                    response = self.schema.select(response)
+                self.coalescer.resolve(('kroger',item_id,location_id,self.schema),claims[item_id][0],response)
+                responses[item_id] = response
+        except BaseException as e:
+            for item_id in owned:
+                if not claims[item_id][0].done():
+                    self.coalescer.resolve(('kroger',item_id,location_id,self.schema),claims[item_id][0],error=e)
+            raise
+
+        for item_id in missing:
+            if item_id not in responses:
+                responses[item_id] = claims[item_id][0].result()
+        return responses
 
 class KrogerPriceCollector(KrogerCore):
-    def __init__(self,input_file_name,output_file_name):
-        super().__init__(input_file_name,output_file_name)
+    def __init__(self,input_file_name,output_file_name,workers=1,resume=False,cache=None,session=None,scheduler=None):
+        super().__init__(input_file_name,output_file_name,workers,resume,cache,session,scheduler)
+        self.schema = PRICE_SCHEMA # find_price only reads the regular price
 
     def find_price(self,response):
         """ Parses through the dictionary response
             and returns the price if available
 
         Args:
-            response (dict): The JSON response from the Kroger API call for the product
+            response (dict or str): The JSON response from the Kroger API call for the product
+                                    (or 'Connection Error' when the lookup kept failing)
 
         Returns:
             str: The price or parsing error message
         """
+        if isinstance(response,str):
+            return response #Handles connection error strings
         try:
             items = response['data']['items'][0]
             try: 
@@ -133,33 +312,138 @@ class KrogerPriceCollector(KrogerCore):
             specified under input_file property and writes the 
             prices to a new csv file under the path specified in the
             output_file property
+
+            Ids are looked up batch_size at a time on up to `workers` threads
+            at once while rows are still written in the same order as the input file.
+            With resume set, ids before the last checkpoint are skipped
+            and the existing output file is appended to
         """
-        with open(self.input_file_name,'r') as read, open(self.output_file_name,'w') as write:
-            csv_reader, csv_writer = csv.reader(read),csv.writer(write)
-            
-            #Skip & Write Headers
+        def to_row(item,response):
+            price = self.find_price(response)
+            if self.history is not None:
+                self.history.record('kroger',item,self.location_id,price)
+            return [item,price]
+
+        collect(self.input_file_name,self.output_file_name,['barcodeData','price'],
+                [fetch_batches(self.get_products,self.batch_size,self.workers),parse(to_row,self.metrics)],
+                resume=self.resume,metrics=self.metrics,row_counts=self.row_counts)
+
+    def collect_changes(self,budget=None):
+        """ Incremental version of collect_prices. Only the products the history
+            considers due (stale for their volatility) are fetched, and only new or
+            changed prices are written, next to the previous price
+
+            An interrupted run needs no checkpoint to pick up where it left off:
+            products it already checked are no longer due. With resume set the
+            output file is appended to instead of overwritten
+
+        Args:
+            budget (int, optional): Max products to fetch, the most overdue first. Defaults to every due product.
+        """
+        checkpoint = Checkpoint(self.output_file_name,self.resume)
+        with open(self.input_file_name,'r') as read, open_sink(self.output_file_name,['barcodeData','price','previousPrice'],checkpoint) as sink:
+            csv_reader = csv.reader(read)
+
+            #Skip Headers
             next(csv_reader)
-            csv_writer.writerow(['barcodeData','price'])
 
-            for val,line in enumerate(csv_reader):
-                item = line[0]
-                response = self.get_product(item)
-                price = self.find_price(response)
-                print(f'{val+1} | {item}: ${price}')
-                csv_writer.writerow([item,price])
+            def lookup(chunk):
+                responses = self.get_products(chunk)
+                return [(item,self.find_price(responses[item])) for item in chunk]
+
+            items = self.history.plan('kroger',unique(line[0] for line in csv_reader),self.location_id,budget)
+            for results in ordered_map(lookup,chunks(items,self.batch_size),self.workers):
+                for item,price in results:
+                    changed, previous = self.history.record('kroger',item,self.location_id,price)
+                    if changed:
+                        sink.write([item,price,previous])
+                    self.metrics.row()
+                    checkpoint.advance(sink)
+            checkpoint.save(sink)
+
+    def sweep_prices(self,location_ids):
+        """ Collects the price of every input product at every location in location_ids
+            and writes them in long format (one row per product and location)
+
+            Product/location pairs are streamed from the input file, so memory stays flat
+            however many pairs there are, and looked up batch_size products per call on
+            up to `workers` threads. Each product's rows are written together. Ids repeated
+            in the input are only looked up once and their rows written again at every
+            occurrence. With resume set, products before the last checkpoint are skipped
+
+        Args:
+            location_ids (list): Kroger location ids to price the catalog at
+        """
+        checkpoint = Checkpoint(self.output_file_name,self.resume)
+        repeats = find_repeats(read_ids(self.input_file_name,0,checkpoint))
+        with open_sink(self.output_file_name,['locationId','barcodeData','price'],checkpoint) as sink:
+            def lookup(pair):
+                chunk, location_id = pair
+                responses = self.get_products(chunk,location_id)
+                return chunk, location_id, [self.find_price(responses[item]) for item in chunk]
+
+            def products(items):
+                """ Yields every product of items with its rows at all locations """
+                pairs = ((chunk,location_id) for chunk in chunks(items,self.batch_size) for location_id in location_ids)
+                for results in chunks(ordered_map(lookup,pairs,self.workers),len(location_ids)):
+                    for i,item in enumerate(results[0][0]):
+                        yield item, [[location_id,item,prices[i]] for _,location_id,prices in results]
+
+            items = unique(read_ids(self.input_file_name,0,checkpoint),set(repeats))
+            for item,rows in fan_out(read_ids(self.input_file_name,0,checkpoint),products(items),repeats,self.metrics):
+                for row in rows:
+                    sink.write(row)
+                self.metrics.row(len(rows))
+                checkpoint.advance(sink)
+            checkpoint.save(sink)
 
-    def run(self):
+    def run(self,location_ids=None,budget=None):
         """ Calls authentication functions in proper order
-            and then collects prices
+            and then collects prices (at every location in location_ids when given,
+            or only the changed ones when a history is set)
         """
-        self.get_credentials()
-        self.get_access_token()
-        self.collect_prices()
+        self.authenticate()
+        if location_ids:
+            self.sweep_prices(location_ids)
+        elif self.history is not None:
+            self.collect_changes(budget)
+        else:
+            self.collect_prices()
         
 
 if __name__ == '__main__':   
+    parser = ArgumentParser()
+    parser.add_argument('input_file',nargs='?',help='csv file of kroger product ids (prompted for when left out)')
+    parser.add_argument('output_file',nargs='?',help='csv file or .parquet directory to write to (prompted for when left out)')
+    parser.add_argument('--workers',type=int,default=1,help='number of concurrent product lookups')
+    parser.add_argument('--resume',action='store_true',help='continue an interrupted run from its checkpoint')
+    parser.add_argument('--cache',help='path to a sqlite response cache reused across runs')
+    parser.add_argument('--http2',action='store_true',help='use an HTTP/2 session (requires httpx[http2])')
+    parser.add_argument('--locations',help='comma separated location ids to sweep prices across')
+    parser.add_argument('--batch-size',type=int,default=MAX_BATCH_SIZE,help=f'product ids per products search call, 1 to {MAX_BATCH_SIZE} (1 disables batching)')
+    parser.add_argument('--token-file',help='file the access token is saved to and reused from across runs')
+    parser.add_argument('--history',help='path to a sqlite price history, only fetches due products and writes changed prices')
+    parser.add_argument('--budget',type=int,help='max products to fetch in a --history run, most overdue first')
+    parser.add_argument('--metrics',help='file the run metrics are written to (prometheus text, or json for a .json path)')
+    args = parser.parse_args()
+    if not 1 <= args.batch_size <= MAX_BATCH_SIZE:
+        parser.error(f'--batch-size must be between 1 and {MAX_BATCH_SIZE}, the products API page size')
+
     #Collect prices for the kroger uuids
-    input_file = input('Enter path to kroger input file: ')
-    output_file = input('Enter path to kroger output file: ')
-    kroger = KrogerPriceCollector(input_file,output_file)
-    kroger.run()
\ No newline at end of file
+    input_file = args.input_file or input('Enter path to kroger input file: ')
+    output_file = args.output_file or input('Enter path to kroger output file: ')
+    cache = ResponseCache(args.cache) if args.cache else None
+    session = make_session(pool_size=max(10,args.workers),http2=args.http2)
+    kroger = KrogerPriceCollector(input_file,output_file,args.workers,args.resume,cache,session)
+    kroger.batch_size = args.batch_size
+    kroger.tokens = TokenManager(kroger.request_access_token,args.token_file)
+    kroger.history = PriceHistory(args.history) if args.history else None
+    METRICS.path = args.metrics
+    kroger.run(args.locations.split(',') if args.locations else None,args.budget)
+    METRICS.report()
+    if cache is not None:
+        print(cache.summary())
+        cache.close()
+    if kroger.history is not None:
+        print(kroger.history.summary())
+        kroger.history.close()
\ No newline at end of file
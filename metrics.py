@@ -0,0 +1,214 @@
+import json
+import os
+from bisect import bisect_left
+from threading import Lock
+from time import monotonic, perf_counter
+
+#Histogram bucket upper bounds in seconds, wide enough for both parse times and slow API calls
+BUCKETS = (0.0001,0.00025,0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0)
+
+class Histogram:
+    """ Fixed bucket histogram (Prometheus style) of durations in seconds """
+    def __init__(self,buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last slot counts values above the largest bucket
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self,value):
+        self.counts[bisect_left(self.buckets,value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self,q):
+        """ Estimates a quantile by interpolating inside the bucket it falls in """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i,count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+class Metrics:
+    """ Thread safe counters and latency histograms for a collection run
+
+        Counters and histograms are keyed by name plus labels (e.g. retailer,
+        endpoint, status). Instead of printing every row, row() prints a short
+        progress summary every `interval` seconds and, when path is set, rewrites
+        the metrics file (Prometheus text format, or JSON for a .json path).
+    """
+    def __init__(self,interval=10.0,path=None):
+        self.interval = interval # Seconds between progress summaries
+        self.path = path # Optional metrics file rewritten with every summary
+        self.counters = {}
+        self.histograms = {}
+        self.started = None
+        self.next_report = 0.0
+        self.lock = Lock()
+
+    @staticmethod
+    def key(name,labels):
+        return name, tuple(sorted(labels.items()))
+
+    def start(self):
+        """ Starts the clock on the first recorded metric (caller holds the lock) """
+        self.started = monotonic()
+        self.next_report = self.started + self.interval
+
+    def reset(self):
+        """ Drops every recorded metric, e.g. in a worker process that inherited its parent's """
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.started = None
+
+    def count(self,name,value=1,**labels):
+        key = self.key(name,labels)
+        with self.lock:
+            if self.started is None:
+                self.start()
+            self.counters[key] = self.counters.get(key,0) + value
+
+    def observe(self,name,seconds,**labels):
+        key = self.key(name,labels)
+        with self.lock:
+            if self.started is None:
+                self.start()
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def timed(self,send,**labels):
+        """ Wraps send (e.g. session.get) so every call records its latency and status code
+
+        Returns:
+            callable: Calls send with the same arguments and returns its response
+        """
+        def call(*args,**kwargs):
+            start = perf_counter()
+            try:
+                r = send(*args,**kwargs)
+            except Exception as e:
+                self.observe('collector_request_seconds',perf_counter() - start,**labels)
+                self.count('collector_requests_total',status=type(e).__name__,**labels)
+                raise
+            self.observe('collector_request_seconds',perf_counter() - start,**labels)
+            self.count('collector_requests_total',status=str(r.status_code),**labels)
+            return r
+        return call
+
+    def total(self,name,**labels):
+        """ Sums a counter over every label set that includes the given labels """
+        wanted = set(labels.items())
+        with self.lock:
+            return sum(value for (key,key_labels),value in self.counters.items()
+                       if key == name and wanted <= set(key_labels))
+
+    def merged(self,name):
+        """ Combines every label set of a histogram into one """
+        merged = Histogram()
+        with self.lock:
+            for (key,_),histogram in self.histograms.items():
+                if key == name:
+                    merged.counts = [a + b for a,b in zip(merged.counts,histogram.counts)]
+                    merged.count += histogram.count
+                    merged.sum += histogram.sum
+        return merged
+
+    def rows_per_second(self):
+        if self.started is None:
+            return 0.0
+        elapsed = monotonic() - self.started
+        return self.total('collector_rows_total') / elapsed if elapsed > 0 else 0.0
+
+    def row(self,value=1):
+        """ Counts finished output rows and reports progress once the interval has passed """
+        self.count('collector_rows_total',value)
+        now = monotonic()
+        if now >= self.next_report:
+            with self.lock:
+                if now < self.next_report: #Another thread just reported
+                    return
+                self.next_report = now + self.interval
+            self.report()
+
+    def summary(self):
+        """ One line overview, e.g. 12000 rows (850.2 rows/s) | 240 requests ... """
+        requests = self.total('collector_requests_total')
+        errors = requests - self.total('collector_requests_total',status='200')
+        hits = self.total('collector_cache_lookups_total',result='hit')
+        lookups = self.total('collector_cache_lookups_total')
+        latency = self.merged('collector_request_seconds')
+        line = f'{self.total("collector_rows_total")} rows ({self.rows_per_second():.1f} rows/s) | {requests} requests, {errors} not 200'
+        line += f', {self.total("collector_retries_total")} retries'
+        if latency.count:
+            line += f' | latency p50 {latency.quantile(0.5) * 1000:.0f}ms p99 {latency.quantile(0.99) * 1000:.0f}ms'
+        if lookups:
+            line += f' | cache {hits / lookups:.1%} hit rate'
+        return line
+
+    def report(self):
+        """ Prints the progress summary and rewrites the metrics file if there is one """
+        print(self.summary())
+        if self.path is not None:
+            self.write(self.path)
+
+    def prometheus(self):
+        """ Renders every metric in the Prometheus text exposition format """
+        def render(name,labels,extra=()):
+            pairs = [*labels,*extra]
+            if not pairs:
+                return name
+            return name + '{' + ','.join(f'{key}="{value}"' for key,value in pairs) + '}'
+
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name,labels),value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f'# TYPE {name} counter')
+                    typed.add(name)
+                lines.append(f'{render(name,labels)} {value}')
+            for (name,labels),histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f'# TYPE {name} histogram')
+                    typed.add(name)
+                cumulative = 0
+                for bound,count in zip([*histogram.buckets,'+Inf'],histogram.counts):
+                    cumulative += count
+                    lines.append(f'{render(name + "_bucket",labels,[("le",bound)])} {cumulative}')
+                lines.append(f'{render(name + "_sum",labels)} {histogram.sum}')
+                lines.append(f'{render(name + "_count",labels)} {histogram.count}')
+        lines.append('# TYPE collector_rows_per_second gauge')
+        lines.append(f'collector_rows_per_second {self.rows_per_second()}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """ Every metric as a JSON ready dict, histograms summarized as count/sum/p50/p99 """
+        def name(key,labels):
+            return key + ('{' + ','.join(f'{k}={v}' for k,v in labels) + '}' if labels else '')
+
+        with self.lock:
+            counters = {name(key,labels): value for (key,labels),value in sorted(self.counters.items())}
+            histograms = {name(key,labels): {'count': h.count,'sum': h.sum,'p50': h.quantile(0.5),'p99': h.quantile(0.99)}
+                          for (key,labels),h in sorted(self.histograms.items())}
+        return {'counters': counters,'histograms': histograms,'rows_per_second': self.rows_per_second()}
+
+    def write(self,path):
+        """ Atomically writes the metrics to path, as JSON for .json files and Prometheus text otherwise """
+        if path.endswith('.json'):
+            text = json.dumps(self.snapshot(),indent=2)
+        else:
+            text = self.prometheus()
+        with open(f'{path}.tmp','w') as f:
+            f.write(text)
+        os.replace(f'{path}.tmp',path)
+
+#Process wide metrics shared by the cores, schedulers and pipelines (like a Prometheus default registry)
+METRICS = Metrics()
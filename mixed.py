@@ -1,33 +1,103 @@
+from concurrent.futures import ThreadPoolExecutor
+from argparse import ArgumentParser
 from kroger import KrogerPriceCollector
-from walmart import WalmartPriceCollector
-import csv
-
-#Setup/Initialization
-input_file = input('Enter Path to Input File: ')
-output_file = input('Enter Path to Output File: ')
-
-krg = KrogerPriceCollector('','')
-krg.get_credentials()
-krg.get_access_token()
-
-wmt = WalmartPriceCollector('','')
-
-def check(line):
-    if line == 'NA':
-        return 'NA'
-    elif len(line) == 13:
-        return krg.find_price(krg.get_product(line))
-    else:
-        return wmt.find_price(wmt.get_product(line),line)[0]
-
-with open(input_file,'r') as f,open(output_file,'w') as f2:
-    csv_reader,csv_writer = csv.reader(f),csv.writer(f2)
-    next(csv_reader)
-    csv_writer.writerow(['Product Id','Price'])
-    for line in csv_reader:
-        item = line[0]
-        price = check(item)
-        print(f'{item}: ${price}')
-        csv_writer.writerow([item,price])
+from walmart import WalmartPrices
+from checkpoint import Checkpoint
+from sinks import open_sink
+from scheduler import RequestScheduler
+from sessions import CONNECTION_ERRORS, make_session
+from cache import ResponseCache
+from workers import routed_map
+from pipeline import fan_out, find_repeats, read_ids, unique
+from metrics import METRICS
 
+class MixedPriceCollector:
+    """ Collects prices for a csv file that mixes Kroger product ids (13 digits)
+        and Walmart product ids
 
+        Each retailer gets its own worker pool, session and rate limit, so a
+        slow or throttled Walmart endpoint doesn't hold up Kroger lookups.
+        Rows are still written in the same order as the input file.
+        Ids repeated in the input are only looked up once.
+    """
+    def __init__(self,input_file_name,output_file_name,kroger_workers=8,walmart_workers=4,resume=False,cache=None):
+        self.input_file_name = input_file_name
+        self.output_file_name = output_file_name
+        self.kroger_workers = kroger_workers
+        self.walmart_workers = walmart_workers
+        self.resume = resume # Continue from the output file's checkpoint instead of starting over
+        self.window = 1000 # Max lookups in flight ahead of the next row to be written
+        self.krg = KrogerPriceCollector('','',kroger_workers,cache=cache,scheduler=RequestScheduler())
+        self.wmt = WalmartPrices('','',scheduler=RequestScheduler(),cache=cache,
+                                 session=make_session(pool_size=max(10,walmart_workers)))
+
+    def authenticate(self):
+        self.krg.authenticate()
+
+    @staticmethod
+    def retailer(item):
+        """ Returns 'kroger', 'walmart' or None (for 'NA') depending on the product id """
+        if item == 'NA':
+            return None
+        return 'kroger' if len(item) == 13 else 'walmart'
+
+    def kroger_price(self,item):
+        try:
+            return self.krg.find_price(self.krg.get_product(item))
+        except CONNECTION_ERRORS:
+            return 'Connection Error'
+
+    def walmart_price(self,item):
+        try:
+            return self.wmt.find_price(self.wmt.get_product(item),item)[0]
+        except CONNECTION_ERRORS:
+            return 'Connection Error'
+
+    def collect_prices(self):
+        """ Collects the price of every product in the input file and writes the results
+            to the output file. With resume set, ids before the last checkpoint are
+            skipped and the output is appended to
+        """
+        checkpoint = Checkpoint(self.output_file_name,self.resume)
+        repeats = find_repeats(read_ids(self.input_file_name,0,checkpoint))
+        with open_sink(self.output_file_name,['Product Id','Price'],checkpoint) as sink, \
+             ThreadPoolExecutor(self.kroger_workers) as kroger_pool, ThreadPoolExecutor(self.walmart_workers) as walmart_pool:
+            routes = {
+                'kroger': (kroger_pool,lambda item: (item,self.kroger_price(item))),
+                'walmart': (walmart_pool,lambda item: (item,self.walmart_price(item))),
+                None: (None,lambda item: (item,'NA')),
+            }
+            def route(item):
+                return routes[self.retailer(item)]
+
+            prices = routed_map(route,unique(read_ids(self.input_file_name,0,checkpoint),set(repeats)),self.window)
+            for item,price in fan_out(read_ids(self.input_file_name,0,checkpoint),prices,repeats):
+                sink.write([item,price])
+                METRICS.row()
+                checkpoint.advance(sink)
+            checkpoint.save(sink)
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('input_file',nargs='?',help='csv file of kroger and walmart product ids (prompted for when left out)')
+    parser.add_argument('output_file',nargs='?',help='csv file or .parquet directory to write to (prompted for when left out)')
+    parser.add_argument('--resume',action='store_true',help='continue an interrupted run from its checkpoint')
+    parser.add_argument('--kroger-workers',type=int,default=8,help='number of concurrent kroger lookups')
+    parser.add_argument('--walmart-workers',type=int,default=4,help='number of concurrent walmart lookups')
+    parser.add_argument('--cache',help='path to a sqlite response cache reused across runs')
+    parser.add_argument('--metrics',help='file the run metrics are written to (prometheus text, or json for a .json path)')
+    args = parser.parse_args()
+
+    #Setup/Initialization
+    input_file = args.input_file or input('Enter Path to Input File: ')
+    output_file = args.output_file or input('Enter Path to Output File: ')
+    cache = ResponseCache(args.cache) if args.cache else None
+
+    mixed = MixedPriceCollector(input_file,output_file,args.kroger_workers,args.walmart_workers,args.resume,cache)
+    METRICS.path = args.metrics
+    mixed.authenticate()
+    mixed.collect_prices()
+    METRICS.report()
+    if cache is not None:
+        print(cache.summary())
+        cache.close()
@@ -0,0 +1,297 @@
+import csv
+import os
+from collections import Counter
+from queue import Queue, Full
+from threading import Event, Thread
+from time import perf_counter
+from checkpoint import Checkpoint
+from metrics import METRICS
+from sinks import open_sink
+from sessions import CONNECTION_ERRORS
+from workers import chunks, ordered_map
+
+_DONE = object() # Marks the end of a buffered stream
+
+def buffered(items,size=1000):
+    """ Runs an iterable on a background thread and yields its elements through a bounded queue.
+        Once `size` elements are waiting the thread blocks, so a slow consumer holds the
+        producer back (backpressure) instead of letting memory grow
+
+    Args:
+        items (iterable): Elements produced on the background thread
+        size (int, optional): Max elements waiting in the queue. Defaults to 1000.
+
+    Yields:
+        The elements of items in order. An exception raised by items is re-raised here.
+    """
+    queue = Queue(size)
+    stop = Event() # Set when the consumer stops early
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                queue.put(entry,timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                if not put((item,None)):
+                    return
+            put((_DONE,None))
+        except Exception as e:
+            put((_DONE,e))
+        finally:
+            if hasattr(iterator,'close'):
+                iterator.close()
+
+    thread = Thread(target=produce,daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = queue.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+def read_ids(input_file_name,column=0,checkpoint=None):
+    """ Source stage: streams the product ids in one column of a csv file
+
+    Args:
+        input_file_name (str): Path to the input csv file (the first row is a header)
+        column (int, optional): Column holding the product id. Defaults to 0.
+        checkpoint (Checkpoint, optional): Rows consumed before the checkpoint are skipped
+
+    Yields:
+        str: Product ids
+    """
+    with open(input_file_name,'r') as read:
+        csv_reader = csv.reader(read)
+
+        #Skip Headers
+        next(csv_reader)
+
+        lines = checkpoint.skip(csv_reader) if checkpoint is not None else csv_reader
+        for line in lines:
+            yield line[column]
+
+def find_repeats(ids):
+    """ Counts the ids that occur more than once, e.g. in an input file with duplicate rows.
+        Every distinct id is counted in memory first, so this pass's peak memory grows
+        with the number of distinct ids in the input (roughly 100 bytes per id).
+        Only the repeated ids are kept afterwards
+
+    Returns:
+        dict: id -> number of occurrences, for repeated ids only
+    """
+    return {item: count for item,count in Counter(ids).items() if count > 1}
+
+def unique(ids,repeated=None):
+    """ Leaves out every occurrence of an id after its first
+
+    Args:
+        ids (iterable): Product ids
+        repeated (set, optional): The ids that can occur more than once (see find_repeats),
+                                  so only those are remembered. Defaults to remembering every id.
+
+    Yields:
+        str: The first occurrence of every id, in order
+    """
+    seen = set()
+    for item in ids:
+        if repeated is None or item in repeated:
+            if item in seen:
+                continue
+            seen.add(item)
+        yield item
+
+def fan_out(ids,results,repeats,metrics=METRICS):
+    """ Puts results looked up for unique(ids) back at every position of ids.
+        A repeated id's result is kept until its last occurrence, so the results held
+        only grow with the repeated ids currently between their first and last row
+        (find_repeats' up front scan is what grows with the whole catalog)
+
+    Args:
+        ids (iterable): Every id, in order (including repeats)
+        results (iterator): (id, result) pairs for unique(ids), in order
+        repeats (dict): id -> number of occurrences in ids (see find_repeats)
+        metrics (Metrics, optional): Counts the rows served from an earlier occurrence
+
+    Yields:
+        (str, object): Every id of ids and its result
+    """
+    remaining = dict(repeats)
+    kept = {}
+    for item in ids:
+        if item in kept:
+            result = kept[item]
+            metrics.count('collector_duplicate_rows_total')
+        else:
+            _, result = next(results)
+        count = remaining.get(item)
+        if count is not None:
+            if count > 1:
+                remaining[item] = count - 1
+                kept[item] = result
+            else:
+                del remaining[item]
+                kept.pop(item,None)
+        yield item, result
+
+def fetch(get,workers=1):
+    """ Fetch stage: looks every id up with get on up to `workers` threads, keeping input order.
+        Items where the API keeps resetting the connection after every retry
+        get 'Connection Error' as their response
+
+    Args:
+        get (callable): Takes a product id and returns its API response (e.g. get_product)
+        workers (int, optional): Number of concurrent lookups. Defaults to 1.
+
+    Returns:
+        callable: Stage turning an iterable of ids into (id, response) pairs
+    """
+    def lookup(item):
+        try:
+            return item, get(item)
+        except CONNECTION_ERRORS:
+            return item, 'Connection Error'
+
+    def stage(items):
+        return ordered_map(lookup,items,workers)
+    return stage
+
+def fetch_batches(get_many,batch_size,workers=1):
+    """ Fetch stage for APIs that look many ids up in one call (e.g. KrogerCore.get_products)
+
+    Args:
+        get_many (callable): Takes a list of ids and returns a dict of id -> response
+        batch_size (int): Ids per call
+        workers (int, optional): Number of concurrent calls. Defaults to 1.
+
+    Returns:
+        callable: Stage turning an iterable of ids into (id, response) pairs, in input order
+    """
+    def lookup(chunk):
+        responses = get_many(chunk)
+        return [(item,responses[item]) for item in chunk]
+
+    def stage(items):
+        for results in ordered_map(lookup,chunks(items,batch_size),workers):
+            yield from results
+    return stage
+
+def parse(func,metrics=METRICS):
+    """ Parse stage: turns every (id, response) pair into an output row
+
+    Args:
+        func (callable): Takes the id and its response and returns the row to write,
+                         or None to leave the id out of the output. When it raises a
+                         connection error (e.g. a follow up url lookup) it is called
+                         again with 'Connection Error' as the response.
+        metrics (Metrics, optional): Records how long each call of func takes
+
+    Returns:
+        callable: Stage turning (id, response) pairs into (id, row) pairs
+    """
+    def stage(pairs):
+        for item,response in pairs:
+            start = perf_counter()
+            try:
+                row = func(item,response)
+            except CONNECTION_ERRORS:
+                row = func(item,'Connection Error')
+            metrics.observe('collector_parse_seconds',perf_counter() - start)
+            yield item, row
+    return stage
+
+class Pipeline:
+    """ Streams product ids from a source through fetch and parse stages
+
+        The source and every stage run on their own thread and hand their output to
+        the next stage through a bounded queue, so reading, fetching, parsing and
+        writing overlap while memory stays flat. Iterating yields (id, row) pairs
+        in input order, e.g.
+
+            for item,row in Pipeline(ids,fetch(walmart.get_product,4),parse(to_row)):
+
+        When iteration ends, stops early or a stage raises, every stage's thread is
+        stopped and joined, downstream first, before the exception (if any) propagates.
+        So no fetch thread keeps sending requests after the pipeline is closed.
+    """
+    def __init__(self,source,*stages,queue_size=1000):
+        self.source = source # Iterable of product ids
+        self.stages = stages # Callables taking the previous stage's iterable and returning the next one
+        self.queue_size = queue_size # Max elements waiting between two stages
+
+    def __iter__(self):
+        #A stage that raised has already finished, so closing the last buffer alone
+        #would leave the buffers upstream of it (and their thread pools) running
+        buffers = [buffered(self.source,self.queue_size)]
+        for stage in self.stages:
+            buffers.append(buffered(stage(buffers[-1]),self.queue_size))
+        try:
+            yield from buffers[-1]
+        finally:
+            for items in reversed(buffers):
+                items.close()
+
+def collect(input_file_name,output_file_name,columns,stages,column=0,resume=False,queue_size=1000,log=None,metrics=METRICS,dedupe=True,row_counts=None):
+    """ Library entry point running a collection from an input csv to an output file
+        without any prompts. Rows are written in input order and the run is checkpointed
+        like the collectors' own methods, so it can be resumed. Progress is reported
+        periodically through metrics instead of row by row
+
+        Ids repeated in the input are only looked up once: the input is scanned for
+        repeats up front, only the first occurrence of each id goes through the stages
+        and its row is written again at every later occurrence
+
+    Args:
+        input_file_name (str): Path to the input csv file
+        output_file_name (str): Path to the output csv file (or .parquet directory)
+        columns (list): Output column names
+        stages (list): Fetch and parse stages, see fetch, fetch_batches and parse
+        column (int, optional): Input column holding the product id. Defaults to 0.
+        resume (bool, optional): Continue from the output file's checkpoint. Defaults to False.
+        queue_size (int, optional): Max elements waiting between two stages. Defaults to 1000.
+        log (callable, optional): Called with the row number, id and row after each row
+        metrics (Metrics, optional): Counts the rows and prints the progress summaries
+        dedupe (bool, optional): Look repeated ids up only once. Defaults to True.
+        row_counts (str, optional): File recording how many rows each input row produced,
+                                    one byte per input row (e.g. so sharded.py can merge
+                                    shard outputs back in input order). Defaults to None.
+    """
+    checkpoint = Checkpoint(output_file_name,resume)
+    repeats = find_repeats(read_ids(input_file_name,column,checkpoint)) if dedupe else {}
+    with open_sink(output_file_name,columns,checkpoint) as sink:
+        counts = None
+        if row_counts is not None:
+            if checkpoint.resumed:
+                os.truncate(row_counts,checkpoint.input_rows) #Drops rows counted after the checkpoint
+            #Unbuffered, so every row the checkpoint covers has its count on disk
+            counts = open(row_counts,'ab' if checkpoint.resumed else 'wb',buffering=0)
+        rows = iter(Pipeline(unique(read_ids(input_file_name,column,checkpoint),set(repeats)),*stages,queue_size=queue_size))
+        try:
+            start = checkpoint.input_rows + 1
+            for val,(item,row) in enumerate(fan_out(read_ids(input_file_name,column,checkpoint),rows,repeats,metrics),start):
+                if row is not None:
+                    sink.write(row)
+                if counts is not None:
+                    counts.write(b'\x00' if row is None else b'\x01')
+                if log is not None:
+                    log(val,item,row)
+                metrics.row()
+                checkpoint.advance(sink)
+        finally:
+            rows.close()
+            if counts is not None:
+                counts.close()
+        checkpoint.save(sink)
@@ -0,0 +1,102 @@
+import random
+from threading import Lock
+from time import monotonic, sleep
+from sessions import CONNECTION_ERRORS
+from metrics import METRICS
+
+class RequestScheduler:
+    """ Token bucket rate limiter that adapts its rate to how the API responds
+
+        Successful calls slowly ramp the rate up (additive increase) while
+        connection resets, 429s and 5xx responses cut it down (multiplicative
+        decrease) and are retried with jittered exponential backoff. Over a
+        long run the rate settles just under what the endpoint tolerates.
+        Safe to share between threads and collectors.
+    """
+    def __init__(self,rate=5.0,min_rate=0.5,max_rate=50.0,increase=1.0,decrease=0.5,
+                 max_retries=5,backoff=1.0,max_backoff=60.0):
+        self.rate = rate # Requests per second
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase # Requests per second gained per second of clean traffic
+        self.decrease = decrease # Factor the rate is multiplied by when throttled
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.tokens = 1.0
+        self.updated = monotonic()
+        self.last_decrease = 0.0
+        self.lock = Lock()
+        self.metrics = METRICS # Counts retries, see metrics.py
+
+    def acquire(self):
+        """ Blocks until the bucket allows another request """
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(1.0,self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1 # Going negative reserves a slot for this caller
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            sleep(wait)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate,self.rate + self.increase / self.rate)
+
+    def on_throttle(self):
+        with self.lock:
+            now = monotonic()
+            #Concurrent failures from the same burst only count as one signal
+            if now - self.last_decrease >= 1 / self.rate:
+                self.rate = max(self.min_rate,self.rate * self.decrease)
+                self.last_decrease = now
+
+    def backoff_delay(self,attempt,retry_after=None):
+        """ Full jitter exponential backoff, honoring a Retry-After header when given """
+        if retry_after is not None:
+            try:
+                return min(self.max_backoff,float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0,min(self.max_backoff,self.backoff * 2 ** attempt))
+
+    @staticmethod
+    def is_throttled(response):
+        return response.status_code == 429 or response.status_code >= 500
+
+    def request(self,send,*args,**kwargs):
+        """ Calls send(*args, **kwargs) under the rate limit, retrying resets,
+            timeouts, 429s and 5xx responses
+
+        Args:
+            send (callable): Function that performs the HTTP call (e.g. session.get)
+
+        Raises:
+            requests.exceptions.ConnectionError: The connection kept failing after max_retries retries
+
+        Returns:
+            requests.Response: The first non throttled response, or the last one if retries ran out
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            retry_after = None
+            try:
+                r = send(*args,**kwargs)
+            except CONNECTION_ERRORS as e:
+                error = e
+            else:
+                if not self.is_throttled(r):
+                    self.on_success()
+                    return r
+                error = None
+                retry_after = r.headers.get('Retry-After')
+
+            self.on_throttle()
+            if attempt < self.max_retries:
+                self.metrics.count('collector_retries_total',reason='throttled' if error is None else 'connection')
+                sleep(self.backoff_delay(attempt,retry_after))
+
+        if error is not None:
+            raise error
+        return r
@@ -0,0 +1,207 @@
+import csv
+import os
+import shutil
+import zlib
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from checkpoint import Checkpoint
+from sinks import from_csv, open_sink
+from scheduler import RequestScheduler
+from sessions import make_session
+from cache import ResponseCache
+from metrics import METRICS
+from kroger import KrogerPriceCollector
+from tokens import TokenManager
+from walmart import WalmartPrices, WalmartGlutenFree, WalmartNutritionFacts, WalmartCombined
+
+def shard_of(item_id,shards):
+    """ Stable shard number of a product id (unlike hash(), the same in every process and run) """
+    return zlib.crc32(item_id.encode('utf-8')) % shards
+
+def split_input(input_file_name,directory,shards,column=0):
+    """ Partitions an input csv into one csv per shard by hashing the product id column.
+        Every shard file keeps the header and the input order of its rows
+
+    Returns:
+        list: Paths to the shard input files
+    """
+    paths = [os.path.join(directory,f'input-{shard:03d}.csv') for shard in range(shards)]
+    files = [open(path,'w') for path in paths]
+    try:
+        writers = [csv.writer(f) for f in files]
+        with open(input_file_name,'r') as read:
+            csv_reader = csv.reader(read)
+            header = next(csv_reader)
+            for writer in writers:
+                writer.writerow(header)
+            for line in csv_reader:
+                writers[shard_of(line[column],shards)].writerow(line)
+    finally:
+        for f in files:
+            f.close()
+    return paths
+
+def row_counts_file(shard_output):
+    """ Path of the file a shard's collector records the rows written per input row in """
+    return f'{shard_output}.rows'
+
+def merge_outputs(input_file_name,output_file_name,shard_outputs,column=0):
+    """ Merges the shard outputs into one output in the order of the input file
+
+        Each input row's shard is recomputed and as many rows as that shard wrote
+        for its next input row (see row_counts_file) are taken from its output.
+        So repeated ids and ids a collector left out stay where they were in the
+        input and the result matches a single process run
+
+    Args:
+        input_file_name (str): The unsplit input csv
+        output_file_name (str): Final output csv file (or .parquet directory). The csv
+                                cells of the shards are converted back to typed values first
+        shard_outputs (list): Shard output csv files, in shard order
+        column (int, optional): Input column holding the product id. Defaults to 0.
+    """
+    files = [open(path,'r') for path in shard_outputs]
+    counts = [open(row_counts_file(path),'rb') for path in shard_outputs]
+    try:
+        readers = [csv.reader(f) for f in files]
+        header = [next(reader) for reader in readers][0]
+        checkpoint = Checkpoint(output_file_name)
+        with open(input_file_name,'r') as read, open_sink(output_file_name,header,checkpoint) as sink:
+            csv_reader = csv.reader(read)
+
+            #Skip Headers
+            next(csv_reader)
+
+            for line in csv_reader:
+                shard = shard_of(line[column],len(readers))
+                for _ in range(ord(counts[shard].read(1))):
+                    sink.write(from_csv(header,next(readers[shard])))
+                checkpoint.advance(sink)
+            checkpoint.save(sink)
+    finally:
+        for f in files + counts:
+            f.close()
+    os.remove(checkpoint.path)
+
+def build_kroger(input_file_name,output_file_name,options):
+    kroger = KrogerPriceCollector(input_file_name,output_file_name,options['workers'],options['resume'],options['cache'],
+                                  options['session'],options['scheduler'])
+    kroger.tokens = TokenManager(kroger.request_access_token,options['token_file'])
+    kroger.row_counts = options['row_counts']
+    kroger.authenticate()
+    return kroger.collect_prices
+
+def build_walmart(collector_class,method):
+    def build(input_file_name,output_file_name,options):
+        walmart = collector_class(input_file_name,output_file_name,options['scheduler'],options['resume'],
+                                  options['cache'],options['session'])
+        walmart.workers = options['workers']
+        walmart.row_counts = options['row_counts']
+        return getattr(walmart,method)
+    return build
+
+#Mode -> (input column holding the product id, function building the shard's collect function)
+MODES = {
+    'kroger': (0,build_kroger),
+    'walmart-prices': (1,build_walmart(WalmartPrices,'collect_prices')),
+    'walmart-gf': (0,build_walmart(WalmartGlutenFree,'label_GF_products')),
+    'walmart-nf': (0,build_walmart(WalmartNutritionFacts,'collect_nutrition')),
+    'walmart-all': (0,build_walmart(WalmartCombined,'collect_all')),
+}
+
+def run_shard(mode,input_file_name,output_file_name,options):
+    """ Collects one shard in a worker process with its own session, source address/proxy and rate limit
+
+    Returns:
+        str: The shard's metrics summary
+    """
+    METRICS.reset() # Pool processes are forked from the parent and may run several shards
+    options = dict(options)
+    options['session'] = make_session(pool_size=max(10,options['workers']),source_address=options['source_address'],
+                                      proxy=options['proxy'])
+    options['scheduler'] = RequestScheduler(rate=options['rate'],max_rate=options['rate'])
+    options['cache'] = ResponseCache(options['cache']) if options['cache'] else None
+    options['row_counts'] = row_counts_file(output_file_name)
+    MODES[mode][1](input_file_name,output_file_name,options)()
+    if options['cache'] is not None:
+        options['cache'].close()
+    return METRICS.summary()
+
+class ShardedCollector:
+    """ Splits a large input csv into shards by hashing the product ids and collects
+        the shards in parallel worker processes, so a run can use every core and
+        several egress ips at once. Each shard gets its own session, source address
+        or proxy and rate limit, and the shard outputs are merged back into input order
+
+        Shard files live in <output file>.shards until the merge succeeds. Rerunning
+        with resume set continues every shard from its own checkpoint.
+    """
+    def __init__(self,mode,input_file_name,output_file_name,shards=4,workers=1,rate=5.0,
+                 source_addresses=None,proxies=None,resume=False,cache=None,token_file=None):
+        self.mode = mode # One of MODES
+        self.input_file_name = input_file_name
+        self.output_file_name = output_file_name
+        self.shards = shards
+        self.workers = workers # Concurrent lookups inside each shard
+        self.rate = rate # Max requests per second of each shard
+        self.source_addresses = source_addresses or [] # Assigned to shards round robin
+        self.proxies = proxies or [] # Assigned to shards round robin
+        self.resume = resume
+        self.cache = cache # Path to a sqlite response cache shared by the shards
+        self.token_file = token_file
+        self.directory = f'{output_file_name}.shards'
+
+    def options(self,shard):
+        return {
+            'workers': self.workers,
+            'rate': self.rate,
+            'source_address': self.source_addresses[shard % len(self.source_addresses)] if self.source_addresses else None,
+            'proxy': self.proxies[shard % len(self.proxies)] if self.proxies else None,
+            'resume': self.resume,
+            'cache': self.cache,
+            'token_file': self.token_file or os.path.join(self.directory,'token.json'),
+        }
+
+    def authenticate(self):
+        """ Gets one kroger access token up front and saves it for every shard to reuse """
+        kroger = KrogerPriceCollector('','')
+        kroger.tokens = TokenManager(kroger.request_access_token,self.options(0)['token_file'])
+        kroger.authenticate()
+
+    def collect(self):
+        column = MODES[self.mode][0]
+        os.makedirs(self.directory,exist_ok=True)
+        inputs = split_input(self.input_file_name,self.directory,self.shards,column)
+        outputs = [os.path.join(self.directory,f'output-{shard:03d}.csv') for shard in range(self.shards)]
+        if self.mode == 'kroger':
+            self.authenticate()
+
+        with ProcessPoolExecutor(self.shards) as pool:
+            futures = [pool.submit(run_shard,self.mode,inputs[shard],outputs[shard],self.options(shard))
+                       for shard in range(self.shards)]
+            for shard,future in enumerate(futures):
+                print(f'Shard {shard}: {future.result()}')
+
+        merge_outputs(self.input_file_name,self.output_file_name,outputs,column)
+        shutil.rmtree(self.directory)
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('mode',choices=list(MODES),help='collector to run on every shard')
+    parser.add_argument('input_file',help='csv file of product ids')
+    parser.add_argument('output_file',help='csv file or .parquet directory to write to')
+    parser.add_argument('--shards',type=int,default=os.cpu_count(),help='number of worker processes')
+    parser.add_argument('--workers',type=int,default=4,help='concurrent lookups inside each shard')
+    parser.add_argument('--rate',type=float,default=5.0,help='max requests per second of each shard')
+    parser.add_argument('--source-addresses',help='comma separated local ips, assigned to the shards round robin')
+    parser.add_argument('--proxies',help='comma separated proxy urls, assigned to the shards round robin')
+    parser.add_argument('--resume',action='store_true',help='continue every shard from its checkpoint')
+    parser.add_argument('--cache',help='path to a sqlite response cache shared by the shards')
+    parser.add_argument('--token-file',help='file the kroger access token is saved to and reused from')
+    args = parser.parse_args()
+
+    sharded = ShardedCollector(args.mode,args.input_file,args.output_file,args.shards,args.workers,args.rate,
+                               args.source_addresses.split(',') if args.source_addresses else None,
+                               args.proxies.split(',') if args.proxies else None,
+                               args.resume,args.cache,args.token_file)
+    sharded.collect()
@@ -0,0 +1,195 @@
+import csv
+import glob
+import os
+from enum import IntEnum
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+class Status(IntEnum):
+    """ Outcome of a price lookup, stored next to the numeric price in typed outputs """
+    OK = 0
+    NO_PRICE = 1
+    DNE = 2
+    OUT_OF_STOCK = 3
+    NOT_FOUND = 4
+    FIND = 5
+    HTTP_ERROR = 6
+    CONNECTION_ERROR = 7
+    NA = 8
+    UNKNOWN = 9
+
+#Sentinel strings the collectors write in place of a price
+STATUS_LABELS = {
+    'No price': Status.NO_PRICE,
+    'DNE': Status.DNE,
+    'Out of Stock': Status.OUT_OF_STOCK,
+    'Product Not Found': Status.NOT_FOUND,
+    'FIND': Status.FIND,
+    'HTTP Error Occured': Status.HTTP_ERROR,
+    'Connection Error': Status.CONNECTION_ERROR,
+    'NA': Status.NA,
+}
+
+#Typed output columns that hold whole numbers, everything else is stored as text
+INTEGER_COLUMNS = {'fat','carbs','protein','calories'}
+
+def split_price(value):
+    """ Splits a price cell into a number and a status
+
+    Args:
+        value (str or float): A price or one of the STATUS_LABELS sentinels
+
+    Returns:
+        (float, Status): The price (None unless the status is OK) and the status
+    """
+    status = STATUS_LABELS.get(value)
+    if status is not None:
+        return None, status
+    try:
+        return float(value), Status.OK
+    except (TypeError, ValueError):
+        return None, Status.UNKNOWN
+
+def from_csv(columns,row):
+    """ Turns a row read back from a csv output into the values the collector wrote,
+        so it can be written to any sink (e.g. when merging csv shard outputs into parquet)
+
+    Args:
+        columns (list): Column names of the row
+        row (list): Cells as read by csv.reader
+
+    Returns:
+        list: The row with empty cells as None and INTEGER_COLUMNS as int
+    """
+    return [None if value == '' else int(value) if name in INTEGER_COLUMNS else value
+            for name,value in zip(columns,row)]
+
+class CsvSink:
+    """ Writes rows to a csv file, the default output format """
+    rows_per_flush = 100
+
+    def __init__(self,path,columns,resume_position=None):
+        if resume_position is None:
+            self.file = open(path,'w')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(columns)
+        else:
+            os.truncate(path,resume_position) #Drops partial rows after the checkpoint
+            self.file = open(path,'a')
+            self.writer = csv.writer(self.file)
+
+    def write(self,row):
+        self.writer.writerow(row)
+
+    def flush(self):
+        """ Flushes buffered rows to disk
+
+        Returns:
+            int: Size of the file in bytes, the position to truncate to when resuming
+        """
+        self.file.flush()
+        return os.fstat(self.file.fileno()).st_size
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+class ParquetSink:
+    """ Streams rows into a directory of parquet files, one file per flushed chunk,
+        so memory stays flat and every finished chunk is readable on its own
+        (e.g. pandas.read_parquet(path) loads the whole directory)
+
+        A price column is stored as a float64 price plus a dictionary encoded
+        status column instead of mixing numbers and sentinel strings.
+    """
+    rows_per_flush = 50000
+
+    def __init__(self,path,columns,resume_position=None):
+        if pa is None:
+            raise ImportError('Parquet output requires pyarrow: pip install pyarrow')
+        self.path = path
+        self.columns = columns
+        self.rows = []
+        self.parts = resume_position or 0
+        os.makedirs(path,exist_ok=True)
+        #Drops chunks written after the checkpoint (or every chunk when starting over)
+        for part in glob.glob(os.path.join(path,'part-*.parquet')):
+            if int(os.path.basename(part)[5:-8]) >= self.parts:
+                os.remove(part)
+
+    def write(self,row):
+        self.rows.append(row)
+
+    def table(self):
+        """ Converts the buffered rows into a typed arrow table """
+        arrays, names = [], []
+        for i,name in enumerate(self.columns):
+            values = [row[i] if i < len(row) else None for row in self.rows]
+            if name.lower() == 'price':
+                prices, statuses = zip(*map(split_price,values))
+                arrays.append(pa.array(prices,pa.float64()))
+                arrays.append(pa.DictionaryArray.from_arrays(pa.array([int(s) for s in statuses],pa.int8()),
+                                                             [s.name for s in Status]))
+                names += [name,'status']
+            elif name in INTEGER_COLUMNS:
+                arrays.append(pa.array(values,pa.int64()))
+                names.append(name)
+            else:
+                arrays.append(pa.array([None if v is None else str(v) for v in values],pa.string()))
+                names.append(name)
+        return pa.Table.from_arrays(arrays,names=names)
+
+    def flush(self):
+        """ Writes the buffered rows as the next part file
+
+        Returns:
+            int: Number of finished part files, the position to truncate to when resuming
+        """
+        if self.rows:
+            part = os.path.join(self.path,f'part-{self.parts:05d}.parquet')
+            pq.write_table(self.table(),f'{part}.tmp')
+            os.replace(f'{part}.tmp',part)
+            self.parts += 1
+            self.rows = []
+        return self.parts
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+#Output file extension -> sink class, anything else is written as csv
+SINKS = {'.parquet': ParquetSink}
+
+def open_sink(path,columns,checkpoint):
+    """ Opens the output sink for path, picking the format from its extension
+
+    Args:
+        path (str): Output file (or directory for parquet) path
+        columns (list): Column names
+        checkpoint (Checkpoint): Checkpoint of the run. When it was resumed the sink
+                                 continues from the checkpointed position, otherwise it starts over.
+
+    Returns:
+        CsvSink or ParquetSink: Sink with write, flush and close methods
+    """
+    sink_class = SINKS.get(os.path.splitext(path)[1].lower(),CsvSink)
+    if checkpoint.resumed:
+        print(f'Resuming after input row {checkpoint.input_rows}')
+        return sink_class(path,columns,checkpoint.output_position)
+    sink = sink_class(path,columns)
+    checkpoint.save(sink)
+    return sink
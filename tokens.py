@@ -0,0 +1,69 @@
+import json
+import os
+from threading import Lock
+from time import time
+
+class TokenManager:
+    """ Keeps an OAuth access token fresh
+
+        The token is refreshed shortly before it expires instead of after a 401,
+        and refreshes are serialized so when many threads find the token stale
+        only one of them calls the auth API while the rest wait for its result.
+        With a path the token is saved to disk and reused by the next process.
+    """
+    def __init__(self,fetch,path=None,margin=60):
+        self.fetch = fetch # Callable returning (access_token, expires_in seconds)
+        self.path = path
+        self.margin = margin # Seconds before expiry at which the token is refreshed
+        self.token = ''
+        self.expires_at = 0.0
+        self.lock = Lock()
+        if path is not None:
+            self.load()
+
+    def valid(self):
+        return bool(self.token) and time() < self.expires_at - self.margin
+
+    def get(self):
+        """ Returns a token that is not about to expire, refreshing it first if needed """
+        if self.valid():
+            return self.token
+        with self.lock:
+            if not self.valid(): #Another thread may have refreshed while this one waited
+                self.refresh()
+            return self.token
+
+    def invalidate(self,stale_token):
+        """ Refreshes a token the API rejected unless another thread already replaced it
+
+        Args:
+            stale_token (str): The access token that got a 401
+        """
+        with self.lock:
+            if self.token == stale_token:
+                self.refresh()
+
+    def refresh(self):
+        """ Gets a new token from the auth API (callers should hold the lock) """
+        token, expires_in = self.fetch()
+        self.token = token
+        self.expires_at = time() + expires_in
+        self.save()
+
+    def load(self):
+        """ Reads a previously saved token, keeping it only if it is still valid """
+        try:
+            with open(self.path,'r') as f:
+                state = json.load(f)
+            self.token, self.expires_at = state['access_token'], state['expires_at']
+        except (OSError,ValueError,KeyError):
+            self.token, self.expires_at = '', 0.0
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp = f'{self.path}.{os.getpid()}.tmp' #Sharded runs save from several processes
+        fd = os.open(tmp,os.O_WRONLY | os.O_CREAT | os.O_TRUNC,0o600) #Only readable by the owner
+        with os.fdopen(fd,'w') as f:
+            json.dump({'access_token': self.token,'expires_at': self.expires_at},f)
+        os.replace(tmp,self.path)
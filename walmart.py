@@ -1,53 +1,268 @@
 import csv
 import re
-import requests
+from collections import namedtuple, OrderedDict
+from threading import Lock
+from argparse import ArgumentParser
+from scheduler import RequestScheduler
+from sessions import CONNECTION_ERRORS, make_session
+from checkpoint import Checkpoint
+from sinks import open_sink
+from cache import ResponseCache
+from history import PriceHistory
+from workers import chunks, ordered_map
+from pipeline import collect, fan_out, fetch, find_repeats, parse, read_ids, unique
+from metrics import METRICS
+from decoding import FULL, Schema
+from coalescing import COALESCER
+
+GLUTEN_INGREDIENTS = ['barley', 'breading', "brewer's yeast", 'bulgur', 'durum', 'farro', 'faro', 'spelt', 'dinkel', 'graham flour', 'hydrolyzed wheat protein', 'kamut', 'malt', 'malt extract', 'malt syrup', 'malt flavoring', 'malt vinegar', 'malted milk', 'matzo', 'matzo meal', 'modified wheat starch', 'oatmeal', 'oat bran', 'oat flour', 'whole oats', 'rye flour', 'seitan', 'semolina', 'triticale', 'wheat bran', 'wheat flour', 'wheat germ', 'wheat starch', 'atta', 'einkorn', 'emmer', 'farina', 'fu']
+
+def trie_regex(trie):
+    """ Turns a character trie into a regex where shared prefixes are only matched once
+        (e.g. 'malt', 'malt syrup' and 'malted milk' become malt(?:ed\ milk|\ syrup)?)
+    """
+    optional = '' in trie # A whole ingredient ends here
+    branches = [re.escape(char) + trie_regex(child) for char,child in sorted(trie.items()) if char]
+    if not branches:
+        return ''
+    if len(branches) == 1 and not optional:
+        return branches[0]
+    return '(?:' + '|'.join(branches) + ')' + ('?' if optional else '')
+
+def compile_ingredients(ingredients):
+    """ Compiles a list of ingredients into one case insensitive regex that
+        only matches whole words, so 'malt' no longer matches 'maltodextrin'
+        and 'fu' no longer matches 'fumaric acid'
+
+    Args:
+        ingredients (list): Ingredient names/phrases
+
+    Returns:
+        re.Pattern: A single pass trie shaped alternation of the ingredients
+    """
+    trie = {}
+    for ingredient in ingredients:
+        node = trie
+        for char in ingredient.lower():
+            node = node.setdefault(char,{})
+        node[''] = {}
+    return re.compile(r'\b' + trie_regex(trie) + r'\b',re.IGNORECASE)
+
+GLUTEN_PATTERN = compile_ingredients(GLUTEN_INGREDIENTS)
+GLUTEN_FREE_PATTERN = re.compile('[gG]luten [fF]ree')
+
+class NutritionFacts(namedtuple('NutritionFacts',['fat','fatUnits','carbs','carbsUnits','protein','proteinUnits','calories'])):
+    """ Parsed nutrition facts, fields in the same order as the nutrition csv output.
+        Fields can also be read by name like the dict find_nutrition_facts used to
+        return (info['fat']), and _asdict() gives that dict
+    """
+    __slots__ = ()
+
+    def __getitem__(self,key):
+        if isinstance(key,str):
+            if key not in self._fields:
+                raise KeyError(key)
+            return getattr(self,key)
+        return super().__getitem__(key)
+
+EMPTY_NUTRITION = NutritionFacts(*[None] * len(NutritionFacts._fields))
+KEY_NUTRIENTS = {'totalFat': 'fat','totalCarbs': 'carbs','protein': 'protein'} # API name -> column
+AMOUNT_PATTERN = re.compile(r'(<)?\s*((?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?)\s*(mcg|mg|g|%)?',re.IGNORECASE)
+UNITS = {'mcg': 'mcg','mg': 'mg','g': 'g','%': '%DV'}
+
+def parse_amount(text,default_unit='g'):
+    """ Parses an amount like '12g', '1,200mg', '<1g' or '10%' from the API
+
+    Args:
+        text (str): amountPerServing/caloriesPerServing value
+        default_unit (str, optional): Unit used when the text has none. Defaults to 'g'.
+
+    Returns:
+        (int, str): Rounded amount (0 for '<' amounts) and its unit, or (None, None) without a number
+    """
+    match = AMOUNT_PATTERN.search(text)
+    if match is None:
+        return None, None
+    less_than, number, unit = match.groups()
+    amount = 0 if less_than else round(float(number.replace(',','')))
+    return amount, UNITS[unit.lower()] if unit else default_unit
+
+def parse_nutrition(response):
+    """ Parses the fat, carbs, protein and calories out of a Walmart API response
+
+    Args:
+        response (dict or str): JSON response (or string error msg) from the API call
+
+    Returns:
+        NutritionFacts: Amounts and units, None for anything the response doesn't have
+    """
+    if not isinstance(response,dict) or 'nutritionFacts' not in response:
+        return EMPTY_NUTRITION
+    nutritionFacts = response['nutritionFacts']
+    values = {}
+
+    calories = nutritionFacts.get('calorieInformation',{}).get('caloriesPerServing')
+    if calories is not None:
+        values['calories'] = parse_amount(calories)[0]
+
+    for nutrient in nutritionFacts.get('keyNutrients',()):
+        column = KEY_NUTRIENTS.get(nutrient.get('name'))
+        if column is None or 'amountPerServing' not in nutrient:
+            continue
+        values[column], values[f'{column}Units'] = parse_amount(nutrient['amountPerServing'])
+
+    return EMPTY_NUTRITION._replace(**values) if values else EMPTY_NUTRITION
+
+def parse_nutrition_batch(responses):
+    """ Parses many (e.g. cached) responses into columns ready for csv or parquet export
+
+    Args:
+        responses (iterable): JSON responses from the API
+
+    Returns:
+        dict: Column name -> list of values, one per response, in NutritionFacts field order
+    """
+    columns = {name: [] for name in NutritionFacts._fields}
+    appends = [column.append for column in columns.values()]
+    for response in responses:
+        for append,value in zip(appends,parse_nutrition(response)):
+            append(value)
+    return columns
+
+#Fields each extractor reads from a response. Everything else is skipped when decoding, see decoding.py
+PRICE_FIELDS = {'store': {'price': ['list','displayPrice'],'isInStock': None}} # find_price
+URL_FIELDS = {'basic': ['productUrl']} # get_url
+GLUTEN_FIELDS = {'detailed': ['description','ingredients']} # is_gluten_free
+NUTRITION_FIELDS = {'nutritionFacts': {'calorieInformation': ['caloriesPerServing'],'keyNutrients': ['name','amountPerServing']}} # parse_nutrition
+
+#itemFields -> fields decoded from its responses by the built in collectors, which opt in to the ones they use
+RESPONSE_SCHEMAS = {
+    'store': Schema(PRICE_FIELDS),
+    'basic': Schema(URL_FIELDS),
+    'detailed': Schema(GLUTEN_FIELDS),
+    'nutritionFacts': Schema(NUTRITION_FIELDS),
+    'all': Schema({**PRICE_FIELDS,**URL_FIELDS,**GLUTEN_FIELDS,**NUTRITION_FIELDS}),
+}
 
 class WalmartCore:
-    def __init__(self,input_file_name,output_file_name):
+    #itemFields whose response depends on the store, everything else is cached once for all stores
+    store_fields = {'store','all'}
+
+    def __init__(self,input_file_name,output_file_name,scheduler=None,resume=False,cache=None,session=None):
         self.input_file_name = input_file_name
         self.output_file_name = output_file_name
+        self.api_base = 'https://grocery.walmart.com'
         self.storeId = 2250 #4000 Red Bank Rd, Cincinnati, OH
-
-    def get_product(self,item_id,field='store'):
-        """ Calls Walmart internal API for specified product and returns the info as a dictionary
+        self.scheduler = scheduler or RequestScheduler() # Pass one scheduler to several collectors to share its rate limit
+        self.resume = resume # Continue from the output file's checkpoint instead of starting over
+        self.cache = cache # Optional ResponseCache shared across runs
+        self.session = session or make_session() # Pooled keep-alive connections, see sessions.py
+        self.timeout = 30 # Seconds before a request counts as a connection error
+        self.shared_responses = OrderedDict() # Recent store independent responses, reused across stores
+        self.shared_responses_size = 10000
+        self.shared_lock = Lock()
+        self.history = None # Optional PriceHistory for incremental runs, see history.py
+        self.workers = 1 # Number of concurrent product lookups
+        self.metrics = METRICS # Request, cache and progress metrics, see metrics.py
+        self.row_counts = None # Optional file recording how many rows each input row produced, see pipeline.collect
+        self.schemas = {} # itemFields -> Schema of the fields the extractors read. Undeclared itemFields are decoded whole
+        self.coalescer = COALESCER # Shares in-flight requests for the same product, see coalescing.py
+
+    def get_product(self,item_id,field='store',store_id=None):
+        """ Calls Walmart internal API for specified product and returns the info as a dictionary.
+            The call goes through the scheduler, which rate limits it and retries resets, 429s and 5xx.
+            Responses are served from the cache when one is set and still fresh.
+            Responses for itemFields with a Schema in the schemas property only hold the
+            declared fields (see decoding.py), every other response is decoded whole.
+            A subclass reading more fields adds them to its schemas (or removes the entry).
+            A request for a product/field/store that is already in flight waits for that
+            call's response instead of sending another one
 
             Args:
                 prod_id (string or int): Walmart product/item id to be searched for
                 field (str, optional):  Specifies what fields are returned from API call 
                                         (basic, detailed, nutritionFacts, store, all). Defaults to 'store'.
+                store_id (int, optional): Store to look the product up at. Defaults to the storeId property.
+
+            Raises:
+                requests.exceptions.ConnectionError: Walmart kept resetting the connection after every retry
 
             Returns:
                 dict: A dictionary following the json structure of the response (or a str when errors occur)
         """
-        url = url = f'https://grocery.walmart.com/v3/api/products/{item_id}?itemFields={field}&storeId={self.storeId}'
-        r = requests.get(url)
+        store_id = store_id or self.storeId
+        store = store_id if field in self.store_fields else ''
+        schema = self.schemas.get(field,FULL) #Callers decoding different fields don't share responses
+        return self.coalescer.call(('walmart',str(item_id),field,str(store),schema),self.request_product,item_id,field,store_id)
+
+    def request_product(self,item_id,field,store_id):
+        """ Looks a product up in the response LRU, then the cache, then the API (see get_product) """
+        store = store_id if field in self.store_fields else ''
+        schema = self.schemas.get(field,FULL)
+        if not store:
+            with self.shared_lock:
+                if (item_id,field) in self.shared_responses:
+                    self.shared_responses.move_to_end((item_id,field))
+                    self.metrics.count('collector_cache_lookups_total',retailer='walmart',result='hit')
+                    return self.shared_responses[(item_id,field)]
+        if self.cache is not None:
+            response = self.cache.get('walmart',item_id,field,store,schema.decode)
+            self.metrics.count('collector_cache_lookups_total',retailer='walmart',result='miss' if response is None else 'hit')
+            if response is not None:
+                return response
+
+        url = f'{self.api_base}/v3/api/products/{item_id}?itemFields={field}&storeId={store_id}'
+        send = self.metrics.timed(self.session.get,retailer='walmart',endpoint=field)
+        r = self.scheduler.request(send,url,timeout=self.timeout)
         if r.status_code == 404:
-            return 'Product Not Found'     
+            response = body = 'Product Not Found'
         elif r.status_code > 404:
-            return 'HTTP Error Occured'
+            return 'HTTP Error Occured' #Not cached so the next run tries again
         else:
-            return r.json()  
-
-    def get_url(self,item_id):
+            body = r.content # The cache keeps the whole body
+            response = schema.decode(body)
+
+        if self.cache is not None:
+            self.cache.set('walmart',item_id,field,store,body)
+        if not store:
+            with self.shared_lock:
+                self.shared_responses[(item_id,field)] = response
+                if len(self.shared_responses) > self.shared_responses_size:
+                    self.shared_responses.popitem(last=False)
+        return response
+
+    def get_url(self,item_id,response=None):
         """ Takes a Walmart product id and returns the url
             for that product after calling the API
 
         Args:
             item_id (str or int): walmart product id
+            response (dict, optional): An already fetched response. Used instead of
+                                       calling the API when it has the basic fields.
+                                       An error string gives 'No URL' without a call.
 
         Returns:
             str: The grocery.walmart url to the product
         """
-        resp = self.get_product(item_id,field='basic')
+        if isinstance(response,str):
+            return 'No URL'
+        if isinstance(response,dict) and 'basic' in response:
+            return self.find_url(response)
+        return self.find_url(self.get_product(item_id,field='basic'))
+
+    @staticmethod
+    def find_url(response):
+        """ Returns the url in a response's basic fields, or 'No URL' """
         try:
-            url = resp["basic"]["productUrl"]
+            url = response["basic"]["productUrl"]
             return f'https://grocery.walmart.com{url}'
-        except KeyError:
+        except (KeyError,TypeError): #TypeError for string error responses
             return 'No URL'
 
 class WalmartPrices(WalmartCore):
-    def __init__(self, input_file_name, output_file_name):
-        super().__init__(input_file_name, output_file_name)
+    def __init__(self, input_file_name, output_file_name, scheduler=None, resume=False, cache=None, session=None):
+        super().__init__(input_file_name, output_file_name, scheduler, resume, cache, session)
+        self.schemas = {**self.schemas,'store': RESPONSE_SCHEMAS['store'],'basic': RESPONSE_SCHEMAS['basic']}
 
     def find_price(self,response,item):
         """ Parses through the json dictionary to find the price of the item
@@ -59,7 +274,7 @@ class WalmartPrices(WalmartCore):
                 list: The first element is the price, the second element is the product's url if it is out of stock 
         """
         if type(response) == str: 
-            return response #Handles HTTP error strings
+            return [response,None] #Handles HTTP error strings
         try:
             store = response['store']
             price = store['price']
@@ -71,44 +286,111 @@ class WalmartPrices(WalmartCore):
                     displayPrice = price['displayPrice']
                     return [str(displayPrice),None]
             except KeyError:
-                url = self.get_url(item)
+                url = self.get_url(item,response)
                 if not store['isInStock']:
                     return ['Out of Stock',url]
                 else: 
                     return ['FIND',url]
         except KeyError:
-            return 'DNE'
+            return ['DNE',None]
     
     def collect_prices(self):
         """ Loads the input data, collects the prices from the walmart API, 
             and writes the results to a new csv file 
 
-            Raises:
-                SystemExit: If Walmart resets/ends the connection because of too many consecutive
-                            API calls from one IP address, the script terminates
+            Items where Walmart keeps resetting the connection after every retry
+            are written as 'Connection Error' and the run moves on. With resume set,
+            ids before the last checkpoint are skipped and the output is appended to
         """    
-        with open(self.input_file_name,'r') as read, open(self.output_file_name,'w') as write:
-            csv_reader, csv_writer = csv.reader(read),csv.writer(write)
-            
-            #Skip & Write Headers
+        def to_row(item,response):
+            price = self.find_price(response,item)
+            if self.history is not None:
+                self.history.record('walmart',item,self.storeId,price[0])
+            return [item,price[0],price[1]]
+
+        collect(self.input_file_name,self.output_file_name,['barcodeData','price','url'],
+                [fetch(self.get_product,self.workers),parse(to_row,self.metrics)],column=1,
+                resume=self.resume,metrics=self.metrics,row_counts=self.row_counts)
+
+    def collect_changes(self,budget=None):
+        """ Incremental version of collect_prices. Only the products the history
+            considers due (stale for their volatility) are fetched, and only new or
+            changed prices are written, next to the previous price
+
+            An interrupted run needs no checkpoint to pick up where it left off:
+            products it already checked are no longer due. With resume set the
+            output file is appended to instead of overwritten
+
+        Args:
+            budget (int, optional): Max products to fetch, the most overdue first. Defaults to every due product.
+        """
+        checkpoint = Checkpoint(self.output_file_name,self.resume)
+        with open(self.input_file_name,'r') as read, open_sink(self.output_file_name,['barcodeData','price','previousPrice','url'],checkpoint) as sink:
+            csv_reader = csv.reader(read)
+
+            #Skip Headers
             next(csv_reader)
-            csv_writer.writerow(['barcodeData','price'])
 
-            for val,line in enumerate(csv_reader):
-                item = line[1]
+            def lookup(item):
                 try:
-                    response = self.get_product(item)
-                    price = self.find_price(response,item)
-                    print(f'{val+1} | {item}: ${price[0]}')
-                    csv_writer.writerow([item,price[0],price[1]])
-                except ConnectionResetError as e:
-                    print(f'Ended on item # {val + 1} | ID: {item}')
-                    raise SystemExit(e)
+                    return item, self.find_price(self.get_product(item),item)
+                except CONNECTION_ERRORS:
+                    return item, ['Connection Error',None]
+
+            items = self.history.plan('walmart',unique(line[1] for line in csv_reader),self.storeId,budget)
+            for item,price in ordered_map(lookup,items,self.workers):
+                changed, previous = self.history.record('walmart',item,self.storeId,price[0])
+                if changed:
+                    sink.write([item,price[0],previous,price[1]])
+                self.metrics.row()
+                checkpoint.advance(sink)
+            checkpoint.save(sink)
+
+    def sweep_prices(self,store_ids):
+        """ Collects the price of every input product at every store in store_ids
+            and writes them in long format (one row per product and store)
+
+            Product/store pairs are streamed from the input file, so memory stays flat
+            however many pairs there are. Store independent lookups (the url of out of
+            stock products) are only made once per product, and ids repeated in the input
+            are only looked up once, their rows being written again at every occurrence.
+            With resume set, products before the last checkpoint are skipped. Looks up to
+            `workers` pairs up at once
+
+        Args:
+            store_ids (list): Walmart store ids to price the catalog at
+        """
+        checkpoint = Checkpoint(self.output_file_name,self.resume)
+        repeats = find_repeats(read_ids(self.input_file_name,1,checkpoint))
+        with open_sink(self.output_file_name,['storeId','barcodeData','price','url'],checkpoint) as sink:
+            def lookup(pair):
+                item, store_id = pair
+                try:
+                    price = self.find_price(self.get_product(item,store_id=store_id),item)
+                except CONNECTION_ERRORS:
+                    price = ['Connection Error',None]
+                return [store_id,item,price[0],price[1]]
+
+            def products(items):
+                """ Yields every product of items with its rows at all stores """
+                pairs = ((item,store_id) for item in items for store_id in store_ids)
+                for rows in chunks(ordered_map(lookup,pairs,self.workers),len(store_ids)):
+                    yield rows[0][1], rows
+
+            items = unique(read_ids(self.input_file_name,1,checkpoint),set(repeats))
+            for item,rows in fan_out(read_ids(self.input_file_name,1,checkpoint),products(items),repeats,self.metrics):
+                for row in rows:
+                    sink.write(row)
+                self.metrics.row(len(rows))
+                checkpoint.advance(sink)
+            checkpoint.save(sink)
 
 class WalmartGlutenFree(WalmartCore):
-    def __init__(self, input_file_name, output_file_name):
-        super().__init__(input_file_name, output_file_name)
-        self.gluten_ingredients =  ['barley', 'breading', "brewer's yeast", 'bulgur', 'durum', 'farro', 'faro', 'spelt', 'dinkel', 'graham flour', 'hydrolyzed wheat protein', 'kamut', 'malt', 'malt extract', 'malt syrup', 'malt flavoring', 'malt vinegar', 'malted milk', 'matzo', 'matzo meal', 'modified wheat starch', 'oatmeal', 'oat bran', 'oat flour', 'whole oats', 'rye flour', 'seitan', 'semolina', 'triticale', 'wheat bran', 'wheat flour', 'wheat germ', 'wheat starch', 'atta', 'einkorn', 'emmer', 'farina', 'fu']
+    def __init__(self, input_file_name, output_file_name, scheduler=None, resume=False, cache=None, session=None):
+        super().__init__(input_file_name, output_file_name, scheduler, resume, cache, session)
+        self.gluten_ingredients = list(GLUTEN_INGREDIENTS)
+        self.gluten_pattern = GLUTEN_PATTERN # Recompile with compile_ingredients after changing gluten_ingredients
+        self.schemas = {**self.schemas,'detailed': RESPONSE_SCHEMAS['detailed']}
 
     def is_gluten_free(self,response):
         """ Parses the JSON response from the Walmart API 
@@ -127,7 +409,7 @@ class WalmartGlutenFree(WalmartCore):
             try:
                 #Look at product description first to see if GF
                 description = detailed['description']
-                if re.search('[gG]luten [fF]ree',description) != None:
+                if GLUTEN_FREE_PATTERN.search(description) != None:
                     return True
                 #Use more indepth ingredient method to see if GF
                 else:
@@ -148,131 +430,160 @@ class WalmartGlutenFree(WalmartCore):
         Returns:
             boolean: Returns True for GF ingredients, False for ingredients w/ gluten
         """
-        for ingredient in self.gluten_ingredients:
-            if re.search(ingredient,prod_ingredients,re.IGNORECASE) != None:
-                return False
-        return True 
+        return self.gluten_pattern.search(prod_ingredients) == None
+
+    def find_gluten_ingredients(self,prod_ingredients):
+        """ Takes a string of ingredients and returns the gluten ingredients found in it
+
+        Args:
+            prod_ingredients (str): String of ingredients for a product
+
+        Returns:
+            list: Lowercase gluten ingredients in the order they appear (empty for GF ingredients)
+        """
+        return [match.lower() for match in self.gluten_pattern.findall(prod_ingredients)]
+
+    def check_ingredients_batch(self,ingredient_strings):
+        """ Runs check_ingredients over many ingredient strings, e.g. from cached responses
+
+        Args:
+            ingredient_strings (iterable): Ingredient strings (None for products without ingredients)
+
+        Returns:
+            list: True/False for each string like check_ingredients, 'NA' where the string is None
+        """
+        search = self.gluten_pattern.search
+        return ['NA' if s is None else search(s) is None for s in ingredient_strings]
 
     def label_GF_products(self):
         """ Takes a csv file of walmart product ids and labels them as GF 
             or not, writing the results to a new file
 
-        Raises:
-            SystemExit: If Walmart resets/ends the connection because of too many consecutive
-                        API calls from one IP address, the script terminates
+            Items where Walmart keeps resetting the connection after every retry
+            are written as 'Connection Error' and the run moves on. With resume set,
+            ids before the last checkpoint are skipped and the output is appended to
         """
-        with open(self.input_file_name,'r') as read, open(self.output_file_name,'w') as write:
-            csv_reader, csv_writer = csv.reader(read),csv.writer(write)
+        def to_row(item,response):
+            return [item,self.is_gluten_free(response)]
 
-            #Skip & Write Headers
-            next(csv_reader)
-            csv_writer.writerow(['Product Id','Gluten Free'])
-
-            for val,line in enumerate(csv_reader):
-                item = line[0]
-                try:
-                    response = self.get_product(item,field='detailed')
-                    gf = self.is_gluten_free(response)
-                    print(f'{val+1} | {item}: {gf}')
-                    csv_writer.writerow([item,gf])
-                except ConnectionResetError as e:
-                    print(f'Ended on item # {val + 1} | ID: {item}')
-                    raise SystemExit(e)
+        collect(self.input_file_name,self.output_file_name,['Product Id','Gluten Free'],
+                [fetch(lambda item: self.get_product(item,field='detailed'),self.workers),parse(to_row,self.metrics)],
+                resume=self.resume,metrics=self.metrics,row_counts=self.row_counts)
 
 class WalmartNutritionFacts(WalmartCore):
-    def __init__(self, input_file_name, output_file_name):
-        super().__init__(input_file_name, output_file_name)
+    def __init__(self, input_file_name, output_file_name, scheduler=None, resume=False, cache=None, session=None):
+        super().__init__(input_file_name, output_file_name, scheduler, resume, cache, session)
+        self.schemas = {**self.schemas,'nutritionFacts': RESPONSE_SCHEMAS['nutritionFacts']}
 
     def find_nutrition_facts(self,response):
-        find = ['calories','fat','fatUnits','protein','proteinUnits','carbs','carbsUnits']
-        info = {x: None for x in find}
-        
-        if 'nutritionFacts' in response:
-            nutritionFacts = response['nutritionFacts']
-            
-            if 'calorieInformation' in nutritionFacts:
-                calorieInformation = nutritionFacts['calorieInformation']
-                if 'caloriesPerServing' in calorieInformation:
-                    calories = calorieInformation['caloriesPerServing']
-                    pattern = re.compile('\d+\.?\d?',re.IGNORECASE)
-                    info['calories'] = round(float(pattern.findall(calories)[0]))
-        
-            if 'keyNutrients' in nutritionFacts:
-                keyNutrients = nutritionFacts['keyNutrients']
-
-                for nutrient in keyNutrients:
-                    pattern = re.compile('\d+\.?\d?')
-                    
-                    if 'amountPerServing' not in nutrient:
-                        continue
-            
-                    amt = nutrient['amountPerServing']
-
-                    if '<' in amt: amt = 0
-                    else: 
-                        nums = pattern.findall(amt)
-                        if len(nums) > 0:
-                            amt = round(float(nums[0]))
-
-                    #Fat
-                    if nutrient['name'] == 'totalFat':
-                        info['fat'] = amt
-                        info['fatUnits'] = 'g'
-
-                    #Carbs
-                    if nutrient['name'] == 'totalCarbs':
-                        info['carbs'] = amt
-                        info['carbsUnits'] = 'g'
-                
-                    #Protein
-                    if nutrient['name'] == 'protein':
-                        info['protein'] = amt
-                        info['proteinUnits'] = 'g'
-                
-            return info
+        """ Parses the fat, carbs, protein and calories out of the JSON response
 
-        else:
-            return info
+        Args:
+            response (dict or str): JSON response (or string error msg) from the API call
+
+        Returns:
+            NutritionFacts: Amounts and units, None for anything the response doesn't have.
+                            Reads like the old dict too, e.g. info['fat']
+        """
+        return parse_nutrition(response)
     
     def collect_nutrition(self):
         """ Loads the input data, collects nutrition facts from the walmart API, 
             and writes the results to a new csv file 
 
-            Raises:
-                SystemExit: If Walmart resets/ends the connection because of too many consecutive
-                            API calls from one IP address, the script terminates
+            Items where Walmart keeps resetting the connection after every retry are skipped.
+            With resume set, ids before the last checkpoint are skipped and the output is appended to
         """    
-        with open(self.input_file_name,'r') as read, open(self.output_file_name,'w') as write:
-            csv_reader, csv_writer = csv.reader(read),csv.writer(write)
-            
-            #Skip & Write Headers
-            next(csv_reader)
-            csv_writer.writerow(['barcodeData','fat','fatUnits','carbs','carbsUnits','protein','proteinUnits','calories'])
-            
-            for val,line in enumerate(csv_reader):
-                item = line[0]
-                try:
-                    response = self.get_product(item,field='nutritionFacts')
-                    info = self.find_nutrition_facts(response)
-                    print(f'{val+1} | {item} Done')
-                    row = [item,info['fat'],info['fatUnits'],info['carbs'],info['carbsUnits'],info['protein'],info['proteinUnits'],info['calories']]
-                    csv_writer.writerow(row)
-                except requests.exceptions.ConnectionError as e:
-                    print(e)
-                    continue
+        def to_row(item,response):
+            if response == 'Connection Error':
+                return None
+            return [item,*self.find_nutrition_facts(response)]
+
+        collect(self.input_file_name,self.output_file_name,['barcodeData',*NutritionFacts._fields],
+                [fetch(lambda item: self.get_product(item,field='nutritionFacts'),self.workers),parse(to_row,self.metrics)],
+                resume=self.resume,metrics=self.metrics,row_counts=self.row_counts)
+
+class WalmartCombined(WalmartPrices,WalmartGlutenFree,WalmartNutritionFacts):
+    """ Collects prices, urls, gluten free labels and nutrition facts from a
+        single itemFields=all request per product instead of one request per mode
+    """
+    def __init__(self, input_file_name, output_file_name, scheduler=None, resume=False, cache=None, session=None):
+        super().__init__(input_file_name, output_file_name, scheduler, resume, cache, session)
+        self.id_column = 0 # Column of the input csv holding the walmart product id
+        self.schemas = {**self.schemas,'all': RESPONSE_SCHEMAS['all']}
+
+    def get_url(self,item_id,response=None):
+        """ Only takes the url from the itemFields=all response, so every product stays a single request """
+        return self.find_url(response)
+
+    def collect_all(self):
+        """ Loads the input data, fetches every field of each product in one API call
+            and writes price, url, gluten free and nutrition columns to one wide csv file
+
+            Items where Walmart keeps resetting the connection after every retry
+            are written as 'Connection Error' and the run moves on. With resume set,
+            ids before the last checkpoint are skipped and the output is appended to
+        """
+        nutrients = NutritionFacts._fields
+        def to_row(item,response):
+            if response == 'Connection Error':
+                return [item,'Connection Error',None,'Connection Error'] + [None] * len(nutrients)
+            price = self.find_price(response,item)
+            url = price[1] or self.find_url(response)
+            return [item,price[0],url,self.is_gluten_free(response),*self.find_nutrition_facts(response)]
+
+        collect(self.input_file_name,self.output_file_name,['barcodeData','price','url','Gluten Free',*nutrients],
+                [fetch(lambda item: self.get_product(item,field='all'),self.workers),parse(to_row,self.metrics)],column=self.id_column,
+                resume=self.resume,metrics=self.metrics,row_counts=self.row_counts)
 
 if __name__ == '__main__':
-    mode = input('Enter GF- flag products as gluten free, P- collect prices, or NF- collet nutrition facts: ')
-    input_file = input('Enter path to walmart input file: ')
-    output_file = input('Enter path to walmart output file: ')
+    parser = ArgumentParser()
+    parser.add_argument('input_file',nargs='?',help='csv file of walmart product ids (prompted for when left out)')
+    parser.add_argument('output_file',nargs='?',help='csv file or .parquet directory to write to (prompted for when left out)')
+    parser.add_argument('--mode',choices=['P','GF','NF','ALL'],help='P, GF, NF or ALL (prompted for when left out)')
+    parser.add_argument('--workers',type=int,default=1,help='number of concurrent product lookups')
+    parser.add_argument('--resume',action='store_true',help='continue an interrupted run from its checkpoint')
+    parser.add_argument('--cache',help='path to a sqlite response cache reused across runs')
+    parser.add_argument('--http2',action='store_true',help='use an HTTP/2 session (requires httpx[http2])')
+    parser.add_argument('--stores',help='comma separated store ids to sweep prices across (P mode)')
+    parser.add_argument('--history',help='path to a sqlite price history, only fetches due products and writes changed prices (P mode)')
+    parser.add_argument('--budget',type=int,help='max products to fetch in a --history run, most overdue first')
+    parser.add_argument('--metrics',help='file the run metrics are written to (prometheus text, or json for a .json path)')
+    args = parser.parse_args()
+
+    mode = args.mode or input('Enter GF- flag products as gluten free, P- collect prices, NF- collet nutrition facts, or ALL- all of them in one pass: ')
+    input_file = args.input_file or input('Enter path to walmart input file: ')
+    output_file = args.output_file or input('Enter path to walmart output file: ')
+    cache = ResponseCache(args.cache) if args.cache else None
+    session = make_session(pool_size=max(10,args.workers),http2=args.http2)
+    METRICS.path = args.metrics
     if mode == 'P':
-        walmart_prices = WalmartPrices(input_file,output_file)
-        walmart_prices.collect_prices()
+        walmart_prices = WalmartPrices(input_file,output_file,resume=args.resume,cache=cache,session=session)
+        walmart_prices.workers = args.workers
+        if args.stores:
+            walmart_prices.sweep_prices(args.stores.split(','))
+        elif args.history:
+            walmart_prices.history = PriceHistory(args.history)
+            walmart_prices.collect_changes(args.budget)
+            print(walmart_prices.history.summary())
+            walmart_prices.history.close()
+        else:
+            walmart_prices.collect_prices()
     elif mode == 'GF':
-        walmart_gf = WalmartGlutenFree(input_file,output_file)
+        walmart_gf = WalmartGlutenFree(input_file,output_file,resume=args.resume,cache=cache,session=session)
+        walmart_gf.workers = args.workers
         walmart_gf.label_GF_products()
     elif mode == 'NF':
-        walmart_nf = WalmartNutritionFacts(input_file,output_file)
+        walmart_nf = WalmartNutritionFacts(input_file,output_file,resume=args.resume,cache=cache,session=session)
+        walmart_nf.workers = args.workers
         walmart_nf.collect_nutrition()
+    elif mode == 'ALL':
+        walmart_all = WalmartCombined(input_file,output_file,resume=args.resume,cache=cache,session=session)
+        walmart_all.workers = args.workers
+        walmart_all.collect_all()
     else:
-        print('No mode (GF or P or NF) entered')
\ No newline at end of file
+        print('No mode (GF or P or NF or ALL) entered')
+    METRICS.report()
+    if cache is not None:
+        print(cache.summary())
+        cache.close()
\ No newline at end of file
@@ -0,0 +1,68 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+
+def chunks(items,size):
+    """ Splits an iterable into lists of up to size elements without reading it all at once """
+    items = iter(items)
+    while True:
+        chunk = list(islice(items,size))
+        if not chunk:
+            return
+        yield chunk
+
+def ordered_map(func,items,workers=1,window=None):
+    """ Applies func to every element of items on a bounded thread pool
+        and yields the results in the same order as the input
+
+    Args:
+        func (callable): Function called once for every element of items
+        items (iterable): Input elements (read lazily so large csv files are never fully loaded)
+        workers (int, optional): Number of worker threads. 1 runs everything inline. Defaults to 1.
+        window (int, optional): Max number of submitted but not yet yielded calls.
+                                Defaults to 4 * workers.
+
+    Yields:
+        The return value of func for each element of items, in input order
+    """
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    window = window or workers * 4
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func,item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def routed_map(route,items,window=1000):
+    """ Like ordered_map, but each element runs on the executor picked by route
+        so independent pools (e.g. one per retailer) work side by side.
+        A slow pool only holds back the others once `window` results are waiting on it
+
+    Args:
+        route (callable): Takes an element and returns (executor, func). A None executor runs func inline.
+        items (iterable): Input elements
+        window (int, optional): Max number of submitted but not yet yielded calls. Defaults to 1000.
+
+    Yields:
+        The return value of func for each element of items, in input order
+    """
+    pending = deque()
+    for item in items:
+        pool, func = route(item)
+        if pool is None:
+            future = Future()
+            future.set_result(func(item))
+        else:
+            future = pool.submit(func,item)
+        pending.append(future)
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()